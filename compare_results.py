@@ -0,0 +1,153 @@
+import argparse
+import json
+import math
+import os
+import sys
+
+
+def load_results(path):
+    """ Return the (metadata, results) of a run, results being a
+    dictionnary {test: {variant: [seconds, ...]}}.
+
+    :arg path, a JSON file written by tests.py, or a directory of the TSV
+    files written by tests.output (e.g. output_el6), without metadata.
+    """
+    if not os.path.isdir(path):
+        stream = open(path)
+        run = json.load(stream)
+        stream.close()
+        return (run['metadata'], run['results'])
+    results = {}
+    for testname in sorted(os.listdir(path)):
+        stream = open(os.path.join(path, testname))
+        lines = [line.rstrip('\n').split('\t') for line in stream
+                 if line.strip()]
+        stream.close()
+        try:
+            values = [[None if value == 'NA' else float(value)
+                       for value in line] for line in lines[1:]]
+        except ValueError:
+            # not a test output (e.g. script_output)
+            continue
+        if not values:
+            continue
+        results[testname] = dict(
+            (variant, [line[index] for line in values
+                       if index < len(line) and line[index] is not None])
+            for (index, variant) in enumerate(lines[0]))
+    return ({}, results)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def mann_whitney(first, second):
+    """ Return the two-sided p-value of the Mann-Whitney U test of two
+    samples, using the normal approximation with the tie correction.
+
+    :arg first, the list of values of the first sample.
+    :arg second, the list of values of the second sample.
+    """
+    (n1, n2) = (len(first), len(second))
+    if not n1 or not n2:
+        return 1.0
+    values = sorted([(value, 0) for value in first]
+                    + [(value, 1) for value in second])
+    total = n1 + n2
+    rank_sum = 0.0
+    ties = 0.0
+    index = 0
+    while index < total:
+        end = index
+        while end + 1 < total and values[end + 1][0] == values[index][0]:
+            end += 1
+        # the tied values share the average of their ranks
+        rank = (index + end) / 2.0 + 1
+        count = end - index + 1
+        rank_sum += rank * len([value for value in values[index:end + 1]
+                                if value[1] == 0])
+        ties += count ** 3 - count
+        index = end + 1
+    u_value = rank_sum - n1 * (n1 + 1) / 2.0
+    mean = n1 * n2 / 2.0
+    variance = n1 * n2 / 12.0 * (
+        (total + 1) - ties / (total * (total - 1) or 1))
+    if variance <= 0:
+        return 1.0
+    z_value = max(abs(u_value - mean) - 0.5, 0) / math.sqrt(variance)
+    return math.erfc(z_value / math.sqrt(2))
+
+
+def compare(old, new, alpha=0.05, threshold=0.05):
+    """ Return a list of (test, variant, old median, new median, ratio,
+    p-value, status) for the test variants present in both runs. The
+    status is SLOWER or FASTER when the difference is significant and
+    larger than the threshold, '' otherwise.
+
+    :arg old, the results of the reference run.
+    :arg new, the results of the run compared to it.
+    :kwarg alpha, significance level of the Mann-Whitney test.
+    :kwarg threshold, minimal relative change of the medians reported.
+    """
+    rows = []
+    for testname in sorted(set(old) & set(new)):
+        for variant in sorted(set(old[testname]) & set(new[testname])):
+            (before, after) = (old[testname][variant],
+                               new[testname][variant])
+            if not before or not after:
+                continue
+            (old_median, new_median) = (median(before), median(after))
+            ratio = new_median / old_median if old_median else float('inf')
+            p_value = mann_whitney(before, after)
+            status = ''
+            if p_value < alpha and abs(ratio - 1) > threshold:
+                status = 'SLOWER' if ratio > 1 else 'FASTER'
+            rows.append((testname, variant, old_median, new_median, ratio,
+                         p_value, status))
+    return rows
+
+
+def print_metadata(old, new):
+    """ Print the metadata entries differing between two runs. """
+    for key in sorted(set(old) | set(new)):
+        if key in ('date', 'duration') or old.get(key) == new.get(key):
+            continue
+        print '%-12s %s -> %s' % (key, old.get(key), new.get(key))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare two benchmark runs and flag the slowdowns')
+    parser.add_argument('old', help='results of the reference run (JSON '
+                        'file written by tests.py or directory of TSV '
+                        'files)')
+    parser.add_argument('new', help='results of the run to compare')
+    parser.add_argument('--alpha', type=float, default=0.05,
+                        help='significance level (default: 0.05)')
+    parser.add_argument('--threshold', type=float, default=0.05,
+                        help='minimal relative change of the median '
+                        'reported (default: 0.05)')
+    args = parser.parse_args(argv)
+
+    (old_metadata, old) = load_results(args.old)
+    (new_metadata, new) = load_results(args.new)
+    print_metadata(old_metadata, new_metadata)
+    rows = compare(old, new, alpha=args.alpha, threshold=args.threshold)
+    print '%-40s %-10s %10s %10s %7s %8s' % (
+        'test', 'variant', 'old', 'new', 'ratio', 'p-value')
+    for entry in rows:
+        print '%-40s %-10s %10.5f %10.5f %7.2f %8.4f %s' % entry
+    slower = [entry for entry in rows if entry[-1] == 'SLOWER']
+    print '%s slower, %s faster, %s compared' % (
+        len(slower), len([entry for entry in rows if entry[-1] == 'FASTER']),
+        len(rows))
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
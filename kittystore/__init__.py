@@ -18,11 +18,22 @@ license.
 
 import abc
 
+# Default number of emails fetched per round trip by the iter_* methods
+BATCH_SIZE = 1000
 
-class KittyStore(object):
-    """ Interface to query emails from the database. """
+# Fields needed to display a list of emails (archives, search results),
+# to be given as `fields` to skip loading the content of the emails
+SUMMARY_FIELDS = ('sender', 'email', 'subject', 'date', 'message_id',
+                  'thread_id')
+
+
+# Base class using ABCMeta under both python 2 and 3, the __metaclass__
+# attribute is ignored by python 3
+ABC = abc.ABCMeta('ABC', (object,), {})
 
-    __metaclass__ = abc.ABCMeta
+
+class KittyStore(ABC):
+    """ Interface to query emails from the database. """
 
     @abc.abstractmethod
     def __init__(self, url, debug=False):
@@ -36,7 +47,76 @@ class KittyStore(object):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def get_archives(self, list_name, start, end):
+    def metrics(self, reset=False):
+        """ Return the statistics of the statements sent to the database,
+        keyed by statement fingerprint (see kittystore.metrics), None if
+        the store was created without metrics.
+
+        :kwarg reset, a boolean to forget the statements recorded so far
+        once returned.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def explain(self, method, *args, **kwargs):
+        """ Call a method of the store and return the plan of each of the
+        read statements it sent to the database, as a list of
+        dictionnaries with the keys statement (its fingerprint), plan and
+        warnings (full scans, sorts not done in memory or using an index,
+        see kittystore.explain).
+
+        :arg method, the name of the method called.
+        :arg args, the arguments of the method.
+        :arg kwargs, the keyword arguments of the method.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_email(self, list_name, email):
+        """ Store an email in the database of a given mailing list.
+
+        :arg list_name, name of the mailing list in which this email
+        should be stored.
+        :arg email, a dictionnary holding the fields of the email, keyed
+        by the column names of kittysamodel.get_table.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_emails(self, list_name, emails):
+        """ Store a batch of emails in the database of a given mailing
+        list, at once.
+
+        :arg list_name, name of the mailing list in which these emails
+        should be stored.
+        :arg emails, a list of dictionnaries holding the fields of the
+        emails, keyed by the column names of kittysamodel.get_table.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def merge_threads(self, list_name, thread_ids, thread_id):
+        """ Move the emails of some threads into another one.
+
+        :arg list_name, name of the mailing list.
+        :arg thread_ids, unique identifiers of the threads merged.
+        :arg thread_id, unique identifier of the thread they are merged
+        into.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_thread_index(self, list_name, batch_size=BATCH_SIZE):
+        """ Return an iterator over the (message_id, thread_id) tuples of
+        all the emails of a given mailing list.
+
+        :arg list_name, name of the mailing list.
+        :kwarg batch_size, number of emails fetched per round trip.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_archives(self, list_name, start, end, fields=None):
         """ Return all the thread started emails between two given dates.
 
         :arg list_name, name of the mailing list in which this email
@@ -45,6 +125,8 @@ class KittyStore(object):
         the interval to query.
         :arg end, a datetime object representing the ending date of
         the interval to query.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
         """
         raise NotImplementedError
 
@@ -59,6 +141,17 @@ class KittyStore(object):
         """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_archive_calendar(self, list_name):
+        """ Return a dictionnary of years, months and number of emails
+        for the months in which emails were posted on a given list:
+        {year: {month: count}}.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_email(self, list_name, message_id):
         """ Return an Email object found in the database corresponding
@@ -105,18 +198,34 @@ class KittyStore(object):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def search_content(self, list_name, keyword):
+    def get_thread_stats(self, list_name, thread_id):
+        """ Return the number of email present in a thread and the list of
+        its participants, as a tuple (length, participants), in a single
+        round trip. This thread is uniquely identified by its thread_id.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg thread_id, unique identifier of the thread as specified in
+        the database.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def search_content(self, list_name, keyword, fields=None):
         """ Returns a list of email containing the specified keyword in
         their content.
 
         :arg list_name, name of the mailing list in which this email
         should be searched.
         :arg keyword, keyword to search in the content of the emails.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
         """
         raise NotImplementedError
 
     @abc.abstractmethod
-    def search_content_subject(self, list_name, keyword):
+    def search_content_subject(self, list_name, keyword, limit=None,
+                               offset=None, fields=None):
         """ Returns a list of email containing the specified keyword in
         their content or their subject.
 
@@ -124,25 +233,243 @@ class KittyStore(object):
         should be searched.
         :arg keyword, keyword to search in the content or subject of
         the emails.
+        :kwarg limit, maximum number of emails returned.
+        :kwarg offset, number of emails skipped when a limit is given.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
         """
         raise NotImplementedError
 
     @abc.abstractmethod
-    def search_sender(self, list_name, keyword):
+    def search_sender(self, list_name, keyword, limit=None,
+                      offset=None, fields=None):
         """ Returns a list of email containing the specified keyword in
         the name or email address of the sender of the email.
 
         :arg list_name, name of the mailing list in which this email
         should be searched.
         :arg keyword, keyword to search in the database.
+        :kwarg limit, maximum number of emails returned.
+        :kwarg offset, number of emails skipped when a limit is given.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
         """
         raise NotImplementedError
 
     @abc.abstractmethod
-    def search_subject(self, list_name, keyword):
+    def search_subject(self, list_name, keyword, fields=None):
         """ Returns a list of email containing the specified keyword in
         their subject.
 
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the subject of the emails.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_search_content(self, list_name, keyword, batch_size=BATCH_SIZE,
+                            fields=None):
+        """ Returns an iterator over the emails containing the specified
+        keyword in their content.
+        The emails are fetched from the database by batches, so that
+        they can be processed before the whole result set is retrieved.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content of the emails.
+        :kwarg batch_size, number of emails fetched per round trip.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_search_content_subject(self, list_name, keyword,
+                                    batch_size=BATCH_SIZE, fields=None):
+        """ Returns an iterator over the emails containing the specified
+        keyword in their content or their subject.
+        The emails are fetched from the database by batches, so that
+        they can be processed before the whole result set is retrieved.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content or subject of
+        the emails.
+        :kwarg batch_size, number of emails fetched per round trip.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_search_sender(self, list_name, keyword, batch_size=BATCH_SIZE,
+                           fields=None):
+        """ Returns an iterator over the emails containing the specified
+        keyword in the name or email address of their sender.
+        The emails are fetched from the database by batches, so that
+        they can be processed before the whole result set is retrieved.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the database.
+        :kwarg batch_size, number of emails fetched per round trip.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_search_subject(self, list_name, keyword, batch_size=BATCH_SIZE,
+                            fields=None):
+        """ Returns an iterator over the emails containing the specified
+        keyword in their subject.
+        The emails are fetched from the database by batches, so that
+        they can be processed before the whole result set is retrieved.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the subject of the emails.
+        :kwarg batch_size, number of emails fetched per round trip.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def page_search_content(self, list_name, keyword, limit=30, token=None,
+                            fields=None):
+        """ Returns a page of the emails containing the specified keyword
+        in their content.
+        The emails are sorted by date, most recent first, and the pages
+        are delimited using the date and the identifier of their last
+        email so that any page costs as much as the first one.
+        Returns a tuple (emails, token) where token should be given back
+        to retrieve the next page, it is None on the last page.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content of the emails.
+        :kwarg limit, number of emails per page.
+        :kwarg token, continuation token returned with the previous page.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def page_search_content_subject(self, list_name, keyword, limit=30,
+                                    token=None, fields=None):
+        """ Returns a page of the emails containing the specified keyword
+        in their content or their subject.
+        The emails are sorted by date, most recent first, and the pages
+        are delimited using the date and the identifier of their last
+        email so that any page costs as much as the first one.
+        Returns a tuple (emails, token) where token should be given back
+        to retrieve the next page, it is None on the last page.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content or subject of
+        the emails.
+        :kwarg limit, number of emails per page.
+        :kwarg token, continuation token returned with the previous page.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def page_search_sender(self, list_name, keyword, limit=30, token=None,
+                           fields=None):
+        """ Returns a page of the emails containing the specified keyword
+        in the name or email address of their sender.
+        The emails are sorted by date, most recent first, and the pages
+        are delimited using the date and the identifier of their last
+        email so that any page costs as much as the first one.
+        Returns a tuple (emails, token) where token should be given back
+        to retrieve the next page, it is None on the last page.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the database.
+        :kwarg limit, number of emails per page.
+        :kwarg token, continuation token returned with the previous page.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def page_search_subject(self, list_name, keyword, limit=30, token=None,
+                            fields=None):
+        """ Returns a page of the emails containing the specified keyword
+        in their subject.
+        The emails are sorted by date, most recent first, and the pages
+        are delimited using the date and the identifier of their last
+        email so that any page costs as much as the first one.
+        Returns a tuple (emails, token) where token should be given back
+        to retrieve the next page, it is None on the last page.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the subject of the emails.
+        :kwarg limit, number of emails per page.
+        :kwarg token, continuation token returned with the previous page.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def count_search_content(self, list_name, keyword):
+        """ Returns the number of emails containing the specified keyword
+        in their content.
+        The emails are counted by the database server, without being
+        retrieved.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content of the emails.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def count_search_content_subject(self, list_name, keyword):
+        """ Returns the number of emails containing the specified keyword
+        in their content or their subject.
+        The emails are counted by the database server, without being
+        retrieved.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content or subject of
+        the emails.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def count_search_sender(self, list_name, keyword):
+        """ Returns the number of emails containing the specified keyword
+        in the name or email address of their sender.
+        The emails are counted by the database server, without being
+        retrieved.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the database.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def count_search_subject(self, list_name, keyword):
+        """ Returns the number of emails containing the specified keyword
+        in their subject.
+        The emails are counted by the database server, without being
+        retrieved.
+
         :arg list_name, name of the mailing list in which this email
         should be searched.
         :arg keyword, keyword to search in the subject of the emails.
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+"""
+KittyCaching - read-through cache in front of a KittyStore.
+
+The results of the queries repeated on every archive page are kept in a
+size-bounded LRU cache, each for a time depending on the query. Adding
+emails to a list invalidates the results cached for this list.
+
+Copyright (C) 2012 Pierre-Yves Chibon
+Author: Pierre-Yves Chibon <pingou@pingoured.fr>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or (at
+your option) any later version.
+See http://www.gnu.org/copyleft/gpl.html  for the full text of the
+license.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from kittystore import KittyStore
+
+# Time in seconds during which the result of each method is kept
+TTLS = {
+    'get_archives': 300,
+    'get_archives_length': 3600,
+    'get_thread_length': 300,
+    'get_list_size': 60,
+}
+
+# Time in seconds during which a store keeps the archive calendar of a
+# list, see CalendarCache
+CALENDAR_TTL = 300
+
+
+def make_key(value):
+    """ Return a hashable version of the arguments of a call: the lists
+    are turned into tuples and the dictionnaries into sorted tuples.
+
+    :arg value, the value to convert.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, make_key(val))
+                            for (key, val) in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(make_key(val) for val in value)
+    return value
+
+
+class QueryCache(object):
+    """ LRU cache of query results, shared by any number of
+    CachedKittyStore.
+
+    The entries are keyed on the list, its generation, the method and
+    its arguments. Invalidating a list starts a new generation, the
+    entries of the previous ones are not reachable anymore and are
+    evicted as the least recently used. The cache is thread-safe.
+    """
+
+    def __init__(self, maxsize=1024, clock=time.time):
+        """ Constructor.
+
+        :kwarg maxsize, maximum number of results kept.
+        :kwarg clock, function returning the current time in seconds.
+        """
+        self.maxsize = maxsize
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, list_name, ttl, function):
+        """ Return the result cached under a key, calling the function to
+        compute it if there is none or if it expired.
+
+        :arg key, a hashable identifying the call within the list.
+        :arg list_name, name of the mailing list queried.
+        :arg ttl, time in seconds during which the result is valid.
+        :arg function, function without arguments computing the result.
+        """
+        with self._lock:
+            key = (list_name, self._generations.get(list_name, 0), key)
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > self.clock():
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # the query runs outside of the lock, concurrent misses on the
+        # same key may both query the store
+        value = function()
+        with self._lock:
+            self._entries[key] = (self.clock() + ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, list_name):
+        """ Forget the results cached for a given mailing list.
+
+        :arg list_name, name of the mailing list.
+        """
+        with self._lock:
+            self._generations[list_name] = \
+                self._generations.get(list_name, 0) + 1
+
+    def clear(self):
+        """ Forget all the results and reset the counters. """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """ Return a dictionnary with the number of hits, misses and
+        results kept.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CalendarCache(object):
+    """ Archive calendars {year: {month: count}} of the lists computed
+    by a store (see get_archive_calendar), kept current with the emails
+    the store adds. The emails added by other stores or processes are
+    not counted, so each calendar is recomputed once its ttl expired.
+    The cache is thread-safe.
+    """
+
+    def __init__(self, ttl=CALENDAR_TTL, clock=time.time):
+        """ Constructor.
+
+        :kwarg ttl, time in seconds during which a calendar is kept.
+        :kwarg clock, function returning the current time in seconds.
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self._calendars = {}
+        self._lock = threading.Lock()
+
+    def _get(self, list_name):
+        """ Return the calendar of a list, None if it is not kept or if
+        it expired. Called with the lock held.
+        """
+        entry = self._calendars.get(list_name)
+        if entry is None:
+            return None
+        if entry[0] <= self.clock():
+            del self._calendars[list_name]
+            return None
+        return entry[1]
+
+    def get(self, list_name):
+        """ Return a copy of the calendar of a given mailing list, None
+        if it has to be computed.
+
+        :arg list_name, name of the mailing list.
+        """
+        with self._lock:
+            calendar = self._get(list_name)
+            if calendar is None:
+                return None
+            return dict((year, dict(months))
+                        for (year, months) in calendar.items())
+
+    def set(self, list_name, calendar):
+        """ Keep the calendar computed for a given mailing list and
+        return a copy of it.
+
+        :arg list_name, name of the mailing list.
+        :arg calendar, the calendar {year: {month: count}}.
+        """
+        with self._lock:
+            self._calendars[list_name] = (self.clock() + self.ttl, calendar)
+            return dict((year, dict(months))
+                        for (year, months) in calendar.items())
+
+    def add(self, list_name, dates):
+        """ Count newly stored emails in the calendar of a given mailing
+        list, if it is kept.
+
+        :arg list_name, name of the mailing list.
+        :arg dates, the dates of the emails, None for the emails without
+        one.
+        """
+        with self._lock:
+            calendar = self._get(list_name)
+            if calendar is None:
+                return
+            for date in dates:
+                if date is not None:
+                    months = calendar.setdefault(date.year, {})
+                    months[date.month] = months.get(date.month, 0) + 1
+
+    def invalidate(self, list_name):
+        """ Forget the calendar of a given mailing list.
+
+        :arg list_name, name of the mailing list.
+        """
+        with self._lock:
+            self._calendars.pop(list_name, None)
+
+
+class CachedKittyStore(object):
+    """ KittyStore caching the results of the methods listed in its ttls
+    and forwarding the other calls to the store it wraps.
+
+    The cached results are shared between the callers and must not be
+    modified. They are plain values, the fields of the emails which were
+    not loaded (see `fields`) are None.
+    """
+
+    def __init__(self, store, cache=None, ttls=None):
+        """ Constructor.
+
+        :arg store, the KittyStore queried on a cache miss.
+        :kwarg cache, the QueryCache to use, defaults to a new one.
+        :kwarg ttls, dictionnary of the methods to cache and the time in
+        seconds during which their result is kept, defaults to TTLS.
+        """
+        self.store = store
+        self.cache = cache if cache is not None else QueryCache()
+        self.ttls = ttls if ttls is not None else TTLS
+
+    def __getattr__(self, name):
+        # only called for the attributes not defined on this class
+        if name == 'store':
+            raise AttributeError(name)
+        attribute = getattr(self.store, name)
+        if name not in self.ttls or not callable(attribute):
+            return attribute
+
+        # the results outlive the session of the store, the stores
+        # returning objects bound to it copy them (KittySAStore.detach)
+        detach = getattr(self.store, 'detach', lambda value: value)
+
+        def cached(list_name, *args, **kwargs):
+            return self.cache.get((name, make_key(args), make_key(kwargs)),
+                                  list_name, self.ttls[name],
+                                  lambda: detach(attribute(list_name, *args,
+                                                           **kwargs)))
+        return cached
+
+    def add_email(self, list_name, email):
+        """ Store an email and invalidate the cache of its list. """
+        try:
+            return self.store.add_email(list_name, email)
+        finally:
+            self.cache.invalidate(list_name)
+
+    def add_emails(self, list_name, emails, **kwargs):
+        """ Store emails and invalidate the cache of their list. """
+        try:
+            return self.store.add_emails(list_name, emails, **kwargs)
+        finally:
+            self.cache.invalidate(list_name)
+
+    def merge_threads(self, list_name, thread_ids, thread_id):
+        """ Merge threads and invalidate the cache of their list. """
+        try:
+            return self.store.merge_threads(list_name, thread_ids,
+                                            thread_id)
+        finally:
+            self.cache.invalidate(list_name)
+
+    def invalidate(self, list_name):
+        """ Forget the results cached for a given mailing list.
+
+        :arg list_name, name of the mailing list.
+        """
+        self.cache.invalidate(list_name)
+
+    def stats(self):
+        """ Return the hit and miss counters of the cache. """
+        return self.cache.stats()
+
+
+KittyStore.register(CachedKittyStore)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+KittyExplain - query plans of the statements run by the store methods.
+
+The stores capture the read statements sent to the database during a
+call of one of their methods, then ask the database for the plan of
+each of them (see KittyStore.explain): EXPLAIN (ANALYZE, BUFFERS, FORMAT
+JSON) for PostgreSQL, the explain command with the executionStats
+verbosity for MongoDB. This module walks the plans to flag the full
+scans and the sorts which could not be done in memory or using an index.
+
+Copyright (C) 2012 Pierre-Yves Chibon
+Author: Pierre-Yves Chibon <pingou@pingoured.fr>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or (at
+your option) any later version.
+See http://www.gnu.org/copyleft/gpl.html  for the full text of the
+license.
+"""
+
+EXPLAIN_SQL = 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+
+# Tables of the PostgreSQL catalog, the statements querying them (e.g.
+# has_table) are not explained
+SYSTEM_TABLES = ('pg_catalog', 'pg_class', 'pg_namespace',
+                 'information_schema')
+
+# MongoDB commands reading documents, the ones which are explained
+READ_COMMANDS = ('find', 'aggregate', 'count', 'distinct')
+
+
+def call(function, *args, **kwargs):
+    """ Call a method of a store, iterating over its result when it is an
+    iterator (iter_* methods) so that all its statements are run.
+
+    :arg function, the method called.
+    :arg args, the arguments of the method.
+    :arg kwargs, the keyword arguments of the method.
+    """
+    result = function(*args, **kwargs)
+    if hasattr(result, 'next') or hasattr(result, '__next__'):
+        for _ in result:
+            pass
+
+
+def is_explained(statement):
+    """ Return whether a SQL statement is a read which can be explained,
+    EXPLAIN ANALYZE runs the statement.
+
+    :arg statement, the SQL statement.
+    """
+    words = statement.lstrip().split(None, 1)
+    if not words or words[0].upper() not in ('SELECT', 'WITH'):
+        return False
+    return not [table for table in SYSTEM_TABLES if table in statement]
+
+
+def walk(value):
+    """ Return an iterator over all the dictionnaries nested in a plan.
+
+    :arg value, the plan, or a part of it.
+    """
+    if isinstance(value, dict):
+        yield value
+        for val in value.values():
+            for nested in walk(val):
+                yield nested
+    elif isinstance(value, (list, tuple)):
+        for val in value:
+            for nested in walk(val):
+                yield nested
+
+
+def unique(values):
+    """ Return the list of the values without duplicates, in order. """
+    seen = []
+    for value in values:
+        if value not in seen:
+            seen.append(value)
+    return seen
+
+
+def sql_warnings(plan):
+    """ Return the problems found in a PostgreSQL plan: the sequential
+    scans and the sorts spilled to disk.
+
+    :arg plan, the result of EXPLAIN (FORMAT JSON).
+    """
+    warnings = []
+    for node in walk(plan):
+        if node.get('Node Type') == 'Seq Scan':
+            warnings.append('Seq Scan on %s' % node.get('Relation Name'))
+        if node.get('Sort Space Type') == 'Disk':
+            warnings.append('Sort spilled to disk (%s kB)'
+                            % node.get('Sort Space Used'))
+    return unique(warnings)
+
+
+def mongo_warnings(explain):
+    """ Return the problems found in a MongoDB explain output: the
+    collection scans and the sorts done in memory.
+
+    :arg explain, the result of the explain command.
+    """
+    warnings = []
+    namespaces = [node['namespace'] for node in walk(explain)
+                  if 'namespace' in node]
+    namespace = namespaces[0] if namespaces else None
+    for node in walk(explain):
+        if node.get('stage') == 'COLLSCAN':
+            warnings.append('COLLSCAN on %s' % namespace)
+        elif node.get('stage') == 'SORT':
+            warnings.append('in-memory SORT on %s' % namespace)
+    return unique(warnings)
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+"""
+KittyGenerator - deterministic synthetic mailing list archives.
+
+The generator produces the emails of a list in chronological order, in
+the layout returned by importer.parse_message, so that they are loaded
+in both stores through their add_emails method. Everything is derived
+from the seed: the same seed and settings always give the same list.
+
+The model: the emails arrive with exponential gaps spread over the date
+range; an email either starts a thread or replies to one of the recently
+active threads, to its last message (the thread gets deeper) or to an
+earlier one (the thread branches). The senders follow a Zipf
+distribution, as do the words of the subjects and contents.
+
+Copyright (C) 2012 Pierre-Yves Chibon
+Author: Pierre-Yves Chibon <pingou@pingoured.fr>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or (at
+your option) any later version.
+See http://www.gnu.org/copyleft/gpl.html  for the full text of the
+license.
+"""
+
+import bisect
+import datetime
+import heapq
+import math
+import random
+
+from kittystore.importer import get_stable_url_id
+
+SYLLABLES = [
+    'ba', 'be', 'bi', 'bo', 'bu', 'da', 'de', 'di', 'do', 'du', 'fa', 'fe',
+    'fi', 'fo', 'ga', 'ge', 'go', 'ka', 'ke', 'ki', 'ko', 'ku', 'la', 'le',
+    'li', 'lo', 'lu', 'ma', 'me', 'mi', 'mo', 'mu', 'na', 'ne', 'ni', 'no',
+    'nu', 'pa', 'pe', 'pi', 'po', 'ra', 're', 'ri', 'ro', 'ru', 'sa', 'se',
+    'si', 'so', 'su', 'ta', 'te', 'ti', 'to', 'tu', 'va', 've', 'vi', 'vo',
+    'za', 'ze', 'zi', 'zo', 'ar', 'el', 'in', 'on', 'ux', 'ys',
+]
+
+DOMAINS = ['example.org', 'example.com', 'example.net', 'mail.example.org']
+
+# Number of emails of each kind kept in the fixtures
+FIXTURE_SAMPLES = 20
+
+
+def zipf_table(size, exponent):
+    """ Return the cumulative weights of the ranks 1 to size of a Zipf
+    distribution, to sample it with zipf_pick.
+
+    :arg size, the number of ranks.
+    :arg exponent, the exponent of the distribution.
+    """
+    table = []
+    total = 0.0
+    for rank in range(1, size + 1):
+        total += 1.0 / rank ** exponent
+        table.append(total)
+    return table
+
+
+def zipf_pick(randomizer, table):
+    """ Return a rank, starting at 0, sampled from a table returned by
+    zipf_table.
+
+    :arg randomizer, the random.Random used.
+    :arg table, the cumulative weights.
+    """
+    return bisect.bisect(table, randomizer.random() * table[-1])
+
+
+class ListGenerator(object):
+    """ Iterable over the emails of a synthetic mailing list, and the
+    fixtures of the queries run against it (see fixtures).
+    """
+
+    def __init__(self, size, seed=0,
+                 start=datetime.datetime(2008, 1, 1),
+                 end=datetime.datetime(2013, 1, 1), senders=5000,
+                 sender_exponent=1.2, vocabulary=50000,
+                 word_exponent=1.07, words=80, reply_ratio=0.8,
+                 deepen_ratio=0.6, active_threads=100):
+        """ Constructor.
+
+        :arg size, the number of emails of the list.
+        :kwarg seed, the seed of the random generators.
+        :kwarg start, the date of the first email.
+        :kwarg end, the date after which no email is sent.
+        :kwarg senders, the number of distinct senders.
+        :kwarg sender_exponent, the exponent of the Zipf distribution of
+        the senders.
+        :kwarg vocabulary, the number of distinct words.
+        :kwarg word_exponent, the exponent of the Zipf distribution of
+        the words.
+        :kwarg words, the median number of words of the contents.
+        :kwarg reply_ratio, the probability of an email to be a reply.
+        :kwarg deepen_ratio, the probability of a reply to answer the
+        last message of its thread rather than an earlier one.
+        :kwarg active_threads, the number of threads receiving replies.
+        """
+        self.size = size
+        self.seed = seed
+        self.start = start
+        self.end = end
+        self.words = words
+        self.reply_ratio = reply_ratio
+        self.deepen_ratio = deepen_ratio
+        self.active_threads = active_threads
+        randomizer = random.Random('%s-names' % seed)
+        self.vocabulary = self._make_words(randomizer, vocabulary, 2, 4)
+        names = self._make_words(randomizer, senders * 2, 2, 3)
+        self.senders = [
+            (u'%s %s' % (names[index].capitalize(),
+                         names[index + senders].capitalize()),
+             u'%s.%s@%s' % (names[index], names[index + senders],
+                            DOMAINS[index % len(DOMAINS)]))
+            for index in range(senders)]
+        self.sender_table = zipf_table(senders, sender_exponent)
+        self.word_table = zipf_table(vocabulary, word_exponent)
+        # the words searched by the harness, from frequent to rare
+        self.keyword_ranks = dict(
+            (name, min(rank, vocabulary - 1)) for (name, rank) in
+            [('frequent', 10), ('medium', 300), ('rare', 10000)])
+        self.keyword_counts = dict(
+            (name, 0) for name in self.keyword_ranks)
+        self.message_ids = []
+        self.threads = []
+        self.generated = 0
+
+    @staticmethod
+    def _make_words(randomizer, count, shortest, longest):
+        """ Return a list of distinct words made of syllables. """
+        words = []
+        seen = set()
+        while len(words) < count:
+            word = ''.join(
+                randomizer.choice(SYLLABLES) for _ in range(
+                    randomizer.randint(shortest, longest)))
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+        return words
+
+    def _text(self, randomizer, count):
+        """ Return a list of `count` words sampled from the vocabulary. """
+        vocabulary = self.vocabulary
+        table = self.word_table
+        return [vocabulary[zipf_pick(randomizer, table)]
+                for _ in range(count)]
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        randomizer = random.Random(self.seed)
+        span = (self.end - self.start).total_seconds()
+        gap = span / max(self.size, 1)
+        elapsed = 0.0
+        # least recently active first, each thread is a list [thread_id,
+        # subject, length, [(message_id, references), ...], subject words]
+        active = []
+        # (length, thread_id) of the longest threads
+        longest = []
+        keywords = dict((self.vocabulary[rank], name) for (name, rank)
+                        in self.keyword_ranks.items())
+        self.keyword_counts = dict((name, 0) for name in self.keyword_ranks)
+        self.message_ids = []
+        self.generated = 0
+        for index in range(self.size):
+            elapsed = min(elapsed + randomizer.expovariate(1.0 / gap),
+                          span - 1)
+            date = self.start + datetime.timedelta(seconds=int(elapsed))
+            message_id = '%08x.%s@%s' % (
+                int(randomizer.random() * 0xffffffff), index,
+                DOMAINS[index % len(DOMAINS)])
+            (sender, address) = self.senders[
+                zipf_pick(randomizer, self.sender_table)]
+            length = max(1, int(randomizer.lognormvariate(
+                math.log(self.words), 0.8)))
+            content = self._text(randomizer, length)
+            if active and randomizer.random() < self.reply_ratio:
+                # the recently active threads get most of the replies
+                position = len(active) - 1 - min(
+                    int(randomizer.expovariate(0.1)), len(active) - 1)
+                thread = active.pop(position)
+                messages = thread[3]
+                if randomizer.random() < self.deepen_ratio:
+                    parent = messages[-1]
+                else:
+                    parent = messages[int(randomizer.random()
+                                          * len(messages))]
+                references = parent[1] + [parent[0]]
+                subject = u'Re: %s' % thread[1]
+                words = thread[4]
+                thread[2] += 1
+                # only the recent messages of a thread get replies
+                messages.append((message_id, references))
+                del messages[:-50]
+                active.append(thread)
+            else:
+                references = []
+                words = self._text(randomizer, 3 + int(
+                    randomizer.random() * 6))
+                subject = u' '.join(words).capitalize()
+                thread = [get_stable_url_id(message_id), subject, 1,
+                          [(message_id, references)], words]
+                active.append(thread)
+                if len(active) > self.active_threads:
+                    self._retire(active.pop(0), longest)
+            for word in set(content + words).intersection(keywords):
+                self.keyword_counts[keywords[word]] += 1
+            lines = [u' '.join(content[line:line + 12])
+                     for line in range(0, len(content), 12)]
+            self._sample(randomizer, self.message_ids, message_id, index)
+            self.generated += 1
+            yield {
+                'sender': sender[:100],
+                'email': address[:75],
+                'subject': subject,
+                'content': u'\n'.join(lines),
+                'date': date,
+                'message_id': message_id[:150],
+                'stable_url_id': get_stable_url_id(message_id),
+                'thread_id': thread[0],
+                'references': ' '.join(references) or None,
+                'in_reply_to': references[-1] if references else None,
+            }
+        for thread in active:
+            self._retire(thread, longest)
+        self.threads = sorted(longest, reverse=True)
+
+    @staticmethod
+    def _retire(thread, longest):
+        """ Keep the thread among the longest ones if it is. """
+        entry = (thread[2], thread[0])
+        if len(longest) < FIXTURE_SAMPLES:
+            heapq.heappush(longest, entry)
+        else:
+            heapq.heappushpop(longest, entry)
+
+    @staticmethod
+    def _sample(randomizer, sample, value, index):
+        """ Keep a uniform sample of the values seen (reservoir). """
+        if len(sample) < FIXTURE_SAMPLES:
+            sample.append(value)
+        else:
+            position = int(randomizer.random() * (index + 1))
+            if position < FIXTURE_SAMPLES:
+                sample[position] = value
+
+    def fixtures(self, list_name):
+        """ Return a dictionnary describing the list, the known ids,
+        keywords, senders and date ranges queried by the harness. Only
+        available once the emails have been generated.
+
+        :arg list_name, name of the mailing list the emails were stored
+        in.
+
+        The count of a keyword is the number of emails containing it in
+        their subject or content.
+        """
+        if self.generated != self.size:
+            raise ValueError('The emails have not been generated')
+        middle = self.start + (self.end - self.start) // 2
+        month = datetime.datetime(middle.year, middle.month, 1)
+        return {
+            'list': list_name,
+            'size': self.size,
+            'seed': self.seed,
+            'start': self.start.isoformat(),
+            'end': self.end.isoformat(),
+            'message_ids': self.message_ids,
+            'threads': [{'thread_id': thread_id, 'length': length}
+                        for (length, thread_id) in self.threads],
+            'keywords': dict(
+                (name, {'word': self.vocabulary[rank],
+                        'count': self.keyword_counts[name]})
+                for (name, rank) in self.keyword_ranks.items()),
+            'senders': [sender for (sender, _) in
+                        self.senders[:FIXTURE_SAMPLES]],
+            'date_ranges': {
+                'week': [month.isoformat(),
+                         (month + datetime.timedelta(days=7)).isoformat()],
+                'month': [month.isoformat(),
+                          (month + datetime.timedelta(days=29)).isoformat()],
+                'year': [month.isoformat(),
+                         (month + datetime.timedelta(days=365)).isoformat()],
+            },
+        }
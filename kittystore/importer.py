@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""
+KittyImporter - bulk import of mbox archives into the stores.
+
+The messages are streamed out of the mbox file, parsed into the column
+layout of kittysamodel.get_table and written into a store by batches
+using its add_emails method.
+
+Copyright (C) 2012 Pierre-Yves Chibon
+Author: Pierre-Yves Chibon <pingou@pingoured.fr>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or (at
+your option) any later version.
+See http://www.gnu.org/copyleft/gpl.html  for the full text of the
+license.
+"""
+
+import base64
+import datetime
+import hashlib
+import mailbox
+import re
+import time
+from email.header import decode_header
+from email.utils import parseaddr, parsedate_tz, mktime_tz
+
+# Default number of emails written per batch
+BATCH_SIZE = 500
+
+MESSAGE_ID_RE = re.compile(r'<([^>]+)>')
+
+
+def get_stable_url_id(message_id):
+    """ Return the identifier of an email used in the URLs, computed
+    from its Message-ID.
+
+    :arg message_id, the Message-ID of the email (without the <>).
+    """
+    if not isinstance(message_id, bytes):
+        message_id = message_id.encode('utf-8')
+    digest = hashlib.sha1(message_id).digest()
+    return base64.b32encode(digest).decode('ascii')
+
+
+def decode_value(value):
+    """ Return the unicode value of a header, decoding its RFC 2047
+    encoded words.
+
+    :arg value, the raw value of the header.
+    """
+    if value is None:
+        return None
+    parts = []
+    for (text, charset) in decode_header(value):
+        if isinstance(text, bytes):
+            try:
+                text = text.decode(charset or 'ascii', 'replace')
+            except LookupError:
+                text = text.decode('ascii', 'replace')
+        parts.append(text)
+    return u' '.join(parts)
+
+
+def get_message_ids(value):
+    """ Return the list of the Message-IDs found in a header
+    (References, In-Reply-To), in their order of appearance.
+
+    :arg value, the raw value of the header.
+    """
+    if not value:
+        return []
+    return MESSAGE_ID_RE.findall(value)
+
+
+def get_content(message):
+    """ Return the text of the text/plain parts of a message, the
+    attachments are left out.
+
+    :arg message, the email.message.Message object.
+    """
+    parts = []
+    for part in message.walk():
+        if part.get_content_type() != 'text/plain' \
+                or part.get('Content-Disposition', '').startswith(
+                    'attachment'):
+            continue
+        payload = part.get_payload(decode=True)
+        if payload is None:
+            continue
+        charset = part.get_content_charset() or 'ascii'
+        try:
+            parts.append(payload.decode(charset, 'replace'))
+        except LookupError:
+            parts.append(payload.decode('ascii', 'replace'))
+    return u'\n'.join(parts)
+
+
+def get_date(message):
+    """ Return the date of a message as a naive UTC datetime, or None if
+    its Date header is missing or cannot be parsed.
+
+    :arg message, the email.message.Message object.
+    """
+    parsed = parsedate_tz(message.get('Date', ''))
+    if parsed is None:
+        return None
+    try:
+        return datetime.datetime.utcfromtimestamp(mktime_tz(parsed))
+    except (ValueError, OverflowError):
+        return None
+
+
+def parse_message(message):
+    """ Return a dictionnary holding the fields of an email keyed by the
+    column names of kittysamodel.get_table, plus in_reply_to (kept in the
+    MongoDB documents only).
+
+    The thread of the email is identified by the stable url id of the
+    first email it references, or of itself when it references none.
+
+    :arg message, the email.message.Message object.
+    """
+    message_ids = get_message_ids(message.get('Message-ID'))
+    if message_ids:
+        message_id = message_ids[0]
+    else:
+        # no Message-ID, derive one from the content of the message
+        raw = message.as_string()
+        if not isinstance(raw, bytes):
+            raw = raw.encode('utf-8', 'replace')
+        message_id = '%s@kittystore' % hashlib.sha1(raw).hexdigest()
+    references = get_message_ids(message.get('References'))
+    in_reply_to = get_message_ids(message.get('In-Reply-To'))
+    if not references:
+        # the thread starters are the emails without references
+        references = in_reply_to
+    (sender, address) = parseaddr(decode_value(message.get('From', '')))
+    root = references[0] if references else message_id
+    return {
+        'sender': (sender or address)[:100],
+        'email': address[:75],
+        'subject': decode_value(message.get('Subject', '')),
+        'content': get_content(message),
+        'date': get_date(message),
+        'message_id': message_id[:150],
+        'stable_url_id': get_stable_url_id(message_id),
+        'thread_id': get_stable_url_id(root),
+        'references': ' '.join(references) or None,
+        'in_reply_to': in_reply_to[0] if in_reply_to else None,
+    }
+
+
+def iter_mbox(path):
+    """ Return an iterator over the parsed emails of a mbox file (see
+    parse_message). The messages are read one at a time.
+
+    :arg path, path to the mbox file.
+    """
+    for message in mailbox.mbox(path, create=False):
+        yield parse_message(message)
+
+
+def batches(iterable, size):
+    """ Return an iterator over lists of at most `size` elements of the
+    given iterable.
+
+    :arg iterable, the iterable to split.
+    :arg size, the number of elements per list.
+    """
+    batch = []
+    for element in iterable:
+        batch.append(element)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_emails(store, list_name, emails, batch_size=BATCH_SIZE,
+                  callback=None, threader=None, **kwargs):
+    """ Import emails into a store, by batches. Returns a tuple (number
+    of emails imported, time spent in seconds).
+
+    If a threader is given, it assigns the thread_id of the emails and
+    the threads it merges are merged in the store after each batch.
+    The table of the list is created first when the store has one (see
+    KittySAStore.create_list).
+
+    :arg store, the KittyStore in which the emails are written.
+    :arg list_name, name of the mailing list in which the emails should
+    be stored.
+    :arg emails, an iterable of dictionnaries holding the fields of the
+    emails (see parse_message).
+    :kwarg batch_size, number of emails written at once.
+    :kwarg callback, function called after each batch with the number
+    of emails imported so far and the time spent.
+    :kwarg threader, a threader.Threader, loaded with the emails already
+    in the store (see Threader.load).
+    :kwarg kwargs, extra arguments given to the add_emails method of the
+    store.
+    """
+    start = time.time()
+    total = 0
+    if hasattr(store, 'create_list'):
+        # the SQL stores need the table of the list before the inserts
+        store.create_list(list_name)
+    for batch in batches(emails, batch_size):
+        if threader is not None:
+            for email in batch:
+                threader.assign(email)
+        store.add_emails(list_name, batch, **kwargs)
+        if threader is not None:
+            for (thread_id, merged) in threader.pop_merges().items():
+                store.merge_threads(list_name, merged, thread_id)
+        total += len(batch)
+        if callback is not None:
+            callback(total, time.time() - start)
+    return (total, time.time() - start)
+
+
+def import_mbox(store, list_name, path, batch_size=BATCH_SIZE,
+                callback=None, threader=None, **kwargs):
+    """ Import the emails of a mbox file into a store, by batches.
+    Returns a tuple (number of emails imported, time spent in seconds).
+
+    :arg store, the KittyStore in which the emails are written.
+    :arg list_name, name of the mailing list in which the emails should
+    be stored.
+    :arg path, path to the mbox file.
+    :kwarg batch_size, number of emails written at once.
+    :kwarg callback, function called after each batch with the number
+    of emails imported so far and the time spent.
+    :kwarg threader, a threader.Threader assigning the thread_id of the
+    emails (see import_emails).
+    :kwarg kwargs, extra arguments given to the add_emails method of the
+    store.
+    """
+    return import_emails(store, list_name, iter_mbox(path),
+                         batch_size=batch_size, callback=callback,
+                         threader=threader, **kwargs)
@@ -16,18 +16,162 @@ license.
 """
 
 from sqlalchemy import (
+    DDL,
     Table,
     Column,
     Integer,
     DateTime,
+    Index,
     #LargeBinary,
     String,
     Text,
+    event,
 )
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import mapper
 
+import threading
+from collections import OrderedDict
 
-def get_table(table, metadata, create=False):
+
+# Weighted document indexed in the search_vector column: the subject
+# weights more than the content when ranking the results
+SEARCH_VECTOR = ("setweight(to_tsvector('english', coalesce(%(row)ssubject, "
+    "'')), 'A') || setweight(to_tsvector('english', "
+    "coalesce(%(row)scontent, '')), 'B')")
+
+# Trigger function keeping the search_vector column current
+SEARCH_VECTOR_FUNCTION = """CREATE OR REPLACE FUNCTION
+kittystore_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := %s;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql""" % (SEARCH_VECTOR % {'row': 'NEW.'})
+
+
+def search_vector_ddl(table):
+    """ Return the SQL statements creating the trigger maintaining the
+    search_vector column of a table and its GIN index (PostgreSQL only).
+
+    :arg table, the name of the table in the database.
+    """
+    return [
+        SEARCH_VECTOR_FUNCTION,
+        ('CREATE TRIGGER "%s_search_vector_update" BEFORE INSERT OR '
+         'UPDATE OF subject, content ON "%s" FOR EACH ROW EXECUTE '
+         'PROCEDURE kittystore_search_vector_update()') % (table, table),
+        ('CREATE INDEX "%s_search_vector_index" ON "%s" USING '
+         'gin(search_vector)') % (table, table),
+    ]
+
+
+# Trigger function keeping the thread summary tables of a list current,
+# it needs PostgreSQL >= 9.5: the upserts let concurrent inserts in a new thread
+# or from a new participant both count their email
+THREAD_SUMMARY_FUNCTION = """CREATE OR REPLACE FUNCTION
+"%(table)s_thread_update"() RETURNS trigger AS $$
+DECLARE
+    new_participant integer := 0;
+    starter varchar(150) := NULL;
+BEGIN
+    INSERT INTO "%(table)s_thread_participant" (thread_id, sender)
+        VALUES (NEW.thread_id, NEW.sender)
+        ON CONFLICT (thread_id, sender) DO NOTHING;
+    GET DIAGNOSTICS new_participant = ROW_COUNT;
+    IF NEW."references" IS NULL THEN
+        starter := NEW.message_id;
+    END IF;
+    INSERT INTO "%(table)s_thread" AS summary (thread_id, length,
+        participants_count, first_date, last_date, starter_id)
+        VALUES (NEW.thread_id, 1, new_participant, NEW.date, NEW.date,
+        starter)
+        ON CONFLICT (thread_id) DO UPDATE SET
+        length = summary.length + 1,
+        participants_count = summary.participants_count
+            + EXCLUDED.participants_count,
+        first_date = least(summary.first_date, EXCLUDED.first_date),
+        last_date = greatest(summary.last_date, EXCLUDED.last_date),
+        starter_id = coalesce(EXCLUDED.starter_id, summary.starter_id);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql"""
+
+
+def thread_summary_ddl(table):
+    """ Return the SQL statements creating the trigger maintaining the
+    thread summary tables of a list table (PostgreSQL >= 9.5 only).
+
+    :arg table, the name of the table in the database.
+    """
+    return [
+        THREAD_SUMMARY_FUNCTION % {'table': table},
+        ('CREATE TRIGGER "%s_thread_update" AFTER INSERT ON "%s" FOR EACH '
+         'ROW EXECUTE PROCEDURE "%s_thread_update"()') % (table, table,
+                                                          table),
+    ]
+
+
+def thread_summary_sql(table, thread_id=False):
+    """ Return the SQL statements filling the thread summary tables of a
+    list table from its content. The summary of the threads to fill
+    should have been deleted before.
+
+    :arg table, the name of the table in the database.
+    :kwarg thread_id, a boolean stipulating whether the statements are
+    restricted to the thread given as the :thread_id parameter.
+    """
+    where = ''
+    if thread_id:
+        where = 'WHERE thread_id = :thread_id '
+    return [
+        ('INSERT INTO "%(table)s_thread_participant" (thread_id, sender) '
+         'SELECT DISTINCT thread_id, sender FROM "%(table)s" %(where)s'
+         ) % {'table': table, 'where': where},
+        ('INSERT INTO "%(table)s_thread" (thread_id, length, '
+         'participants_count, first_date, last_date, starter_id) '
+         'SELECT thread_id, count(*), count(DISTINCT sender), min(date), '
+         'max(date), min(CASE WHEN "references" IS NULL THEN message_id '
+         'END) FROM "%(table)s" %(where)sGROUP BY thread_id'
+         ) % {'table': table, 'where': where},
+    ]
+
+
+def get_thread_tables(table, metadata, create=False):
+    """ For a given list table name, create the tables summarizing its
+    threads and returns their Table objects as a tuple (thread,
+    participant).
+
+    The thread table holds, for each thread, its number of emails and of
+    participants, the date of its first and last emails and the
+    message_id of the email starting it. The participant table holds the
+    distinct senders of each thread.
+
+    :arg table, the name of the list table in the database.
+    :arg metadata, MetaData object containing the information relative
+    to the connection to the database.
+    :kwarg create, a boolean stipulating whether the tables should be
+    created if they do not already exist in the database.
+    """
+    thread = Table('%s_thread' % table, metadata,
+        Column('thread_id', String(150), primary_key=True),
+        Column('length', Integer, nullable=False, default=0),
+        Column('participants_count', Integer, nullable=False, default=0),
+        Column('first_date', DateTime),
+        Column('last_date', DateTime),
+        Column('starter_id', String(150)),
+        extend_existing=True)
+    participant = Table('%s_thread_participant' % table, metadata,
+        Column('thread_id', String(150), primary_key=True),
+        Column('sender', String(100), primary_key=True),
+        extend_existing=True)
+    if create:
+        metadata.create_all()
+    return (thread, participant)
+
+
+def get_table(table, metadata, create=False, search_vector=False,
+              thread_summary=False):
     """ For a given string, create the table with the corresponding name,
     and following the defined structure and returns the Table object of
     the said table.
@@ -37,7 +181,19 @@ def get_table(table, metadata, create=False):
     to the connection to the database.
     :kwarg create, a boolean stipulating whether the table should be
     created if it does not already exist in the database.
+    :kwarg search_vector, a boolean stipulating whether the table has a
+    weighted tsvector column (subject and content) used by the ranked
+    full text searches. The column is kept current by a trigger and
+    indexed, PostgreSQL only.
+    :kwarg thread_summary, a boolean stipulating whether the thread
+    summary tables (see get_thread_tables) are created along with the
+    table, and kept current by a trigger. PostgreSQL only.
     """
+    columns = []
+    if search_vector:
+        columns.append(Column('search_vector', TSVECTOR))
+    known = table in metadata.tables
+    table_name = table
     table = Table( table, metadata,
         Column('id', Integer, primary_key=True),
         Column('sender', String(100), nullable=False),
@@ -52,13 +208,29 @@ def get_table(table, metadata, create=False):
         Column('thread_id', String(150), nullable=False, index=True),
         Column('references', Text),
         #Column('full', LargeBinary),
-        useexisting=True)
+        *columns,
+        extend_existing=True)
+    if not known:
+        # keyset pagination, see KittySAStore._page
+        Index('%s_date_id_index' % table_name, table.c.date.desc(),
+              table.c.id.desc())
+    statements = []
+    if search_vector:
+        statements.extend(search_vector_ddl(table_name))
+    if thread_summary:
+        get_thread_tables(table_name, metadata)
+        statements.extend(thread_summary_ddl(table_name))
+    if not known:
+        for statement in statements:
+            event.listen(table, 'after_create',
+                DDL(statement).execute_if(dialect='postgresql'))
     if create:
         metadata.create_all()
     return table
 
 
-def get_class_object(table, entity_name, metadata, create=False, **kw):
+def get_class_object(table, entity_name, metadata, create=False,
+                     search_vector=False, **kw):
     """ For a given table name, returns the object mapping the said
     table.
 
@@ -67,12 +239,83 @@ def get_class_object(table, entity_name, metadata, create=False, **kw):
     to the connection to the database.
     :kwarg create, a boolean stipulating whether the table should be
     created if it does not already exist in the database.
+    :kwarg search_vector, a boolean stipulating whether the table has a
+    search_vector column, see get_table. The column is never loaded in
+    the objects.
     """
     newcls = type(entity_name, (Email, ), {})
-    mapper(newcls, get_table(table, metadata, create), **kw)
+    if search_vector:
+        kw.setdefault('exclude_properties', ['search_vector'])
+    mapper(newcls, get_table(table, metadata, create, search_vector), **kw)
     return newcls
 
 
+class EmailClassRegistry(object):
+    """ Cache of the mapped Email classes, one per table.
+
+    Building a Table and running mapper() on a new class is more
+    expensive than most of the queries we run, so each class is built
+    once and then shared. The registry is thread-safe and keeps at most
+    `maxsize` classes, the least recently used one is forgotten when the
+    limit is reached.
+    """
+
+    def __init__(self, metadata, maxsize=256, entity_name='email', **kw):
+        """ Constructor.
+
+        :arg metadata, MetaData object containing the information relative
+        to the connection to the database.
+        :kwarg maxsize, maximum number of mapped classes kept.
+        :kwarg entity_name, name given to the generated classes.
+        :kwarg kw, extra arguments given to the mapper.
+        """
+        self.metadata = metadata
+        self.maxsize = maxsize
+        self.entity_name = entity_name
+        self.mapper_kw = kw
+        self._classes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, table, create=False):
+        """ Return the class mapping the given table, building it if it
+        is not yet in the registry.
+
+        :arg table, the name of the table in the database.
+        :kwarg create, a boolean stipulating whether the table should be
+        created if it does not already exist in the database.
+        """
+        with self._lock:
+            newcls = self._classes.pop(table, None)
+            if newcls is None:
+                newcls = get_class_object(table, self.entity_name,
+                    self.metadata, create, **self.mapper_kw)
+            self._classes[table] = newcls
+            while len(self._classes) > self.maxsize:
+                self._dispose(*self._classes.popitem(last=False))
+        return newcls
+
+    def clear(self):
+        """ Forget all the classes kept in the registry. """
+        with self._lock:
+            while self._classes:
+                self._dispose(*self._classes.popitem(last=False))
+
+    def _dispose(self, table, oldcls):
+        """ Forget a class and remove its Table from the metadata, the
+        next get builds a new one. The mapper is left alone: the stores
+        sharing the registry may still be querying through the class
+        (and Mapper.dispose is gone from SQLAlchemy 1.4).
+        """
+        if table in self.metadata.tables:
+            self.metadata.remove(self.metadata.tables[table])
+
+    def __len__(self):
+        return len(self._classes)
+
+    def __contains__(self, table):
+        return table in self._classes
+
+
 class Email(object):
     """ Email table.
 
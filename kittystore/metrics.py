@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""
+KittyMetrics - per statement instrumentation of the stores.
+
+The statements sent to the database are grouped by fingerprint: the SQL
+with its literals and parameters replaced by ?, or the shape of the
+MongoDB command with its values replaced by ?. For each fingerprint the
+number of calls, errors and rows and a histogram of the latencies are
+kept. The latency is the time spent in the driver call, which covers the
+server and the network; the difference with the time of the store method
+is spent fetching and converting the rows (driver and ORM).
+
+Copyright (C) 2012 Pierre-Yves Chibon
+Author: Pierre-Yves Chibon <pingou@pingoured.fr>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or (at
+your option) any later version.
+See http://www.gnu.org/copyleft/gpl.html  for the full text of the
+license.
+"""
+
+import json
+import re
+import threading
+
+# Upper bounds in seconds of the buckets of the latency histograms, from
+# 0.1 ms to about 100 s, the last bucket has no upper bound
+BUCKETS = [0.0001 * 2 ** index for index in range(21)]
+
+SQL_PATTERNS = [
+    # string literals
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    # parameters: %(name)s, %s, :name (not the ::type casts), $1
+    (re.compile(r"%\(\w+\)s|%s|(?<!:):(?!:)\w+|\$\d+"), '?'),
+    # numbers outside of the identifiers
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    # lists of values
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?+)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+# Keys of the MongoDB commands left out of their fingerprint
+IGNORED_KEYS = set(['lsid', '$db', '$clusterTime', '$readPreference',
+                    'txnNumber'])
+
+
+def sql_fingerprint(statement):
+    """ Return the fingerprint of a SQL statement: its text with the
+    literals and the parameters replaced by ?.
+
+    :arg statement, the SQL statement.
+    """
+    for (pattern, replacement) in SQL_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def shape(value):
+    """ Return the shape of a value of a MongoDB command: the keys of
+    the documents are kept, the other values are replaced by ?.
+
+    :arg value, the value of the command.
+    """
+    if isinstance(value, dict):
+        return dict((key, shape(val)) for (key, val) in value.items()
+                    if key not in IGNORED_KEYS)
+    elif isinstance(value, (list, tuple)):
+        shapes = []
+        for val in value:
+            if shape(val) not in shapes:
+                shapes.append(shape(val))
+        return shapes
+    return '?'
+
+
+def command_fingerprint(command_name, database_name, command):
+    """ Return the fingerprint of a MongoDB command: its name, the
+    collection it targets and the shape of its arguments.
+
+    :arg command_name, the name of the command (find, count...).
+    :arg database_name, the name of the database.
+    :arg command, the command document.
+    """
+    collection = command.get(command_name)
+    arguments = dict((key, value) for (key, value) in command.items()
+                     if key != command_name)
+    return '%s %s.%s %s' % (command_name, database_name, collection,
+                            json.dumps(shape(arguments), sort_keys=True))
+
+
+class Histogram(object):
+    """ Counts of the latencies in the buckets of BUCKETS. """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+
+    def add(self, value, count=1):
+        """ Count a latency, in seconds. """
+        for (index, bound) in enumerate(BUCKETS):
+            if value <= bound:
+                break
+        else:
+            index = len(BUCKETS)
+        self.counts[index] += count
+
+    def merge(self, counts):
+        """ Add the counts of another histogram to these ones. """
+        for (index, count) in enumerate(counts):
+            self.counts[index] += count
+
+    def percentile(self, rank):
+        """ Return the upper bound of the bucket holding the percentile,
+        None if the histogram is empty or if it is the last bucket.
+        """
+        total = sum(self.counts)
+        if not total:
+            return None
+        threshold = rank / 100.0 * total
+        cumulated = 0
+        for (index, count) in enumerate(self.counts):
+            cumulated += count
+            if cumulated >= threshold and count:
+                break
+        return BUCKETS[index] if index < len(BUCKETS) else None
+
+
+class Metrics(object):
+    """ Statistics of the statements sent to a database, keyed by their
+    fingerprint. The recording is thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statements = {}
+
+    def _get(self, fingerprint):
+        """ Return the statistics of a fingerprint, creating them. """
+        if fingerprint not in self._statements:
+            self._statements[fingerprint] = {
+                'calls': 0, 'errors': 0, 'rows': 0, 'time': 0.0,
+                'min': None, 'max': None, 'histogram': Histogram()}
+        return self._statements[fingerprint]
+
+    def record(self, fingerprint, elapsed, rows=None, error=False):
+        """ Record a statement.
+
+        :arg fingerprint, the fingerprint of the statement.
+        :arg elapsed, the time spent in seconds.
+        :kwarg rows, the number of rows or documents returned or changed,
+        None if unknown.
+        :kwarg error, a boolean stipulating whether the statement failed.
+        """
+        with self._lock:
+            stats = self._get(fingerprint)
+            stats['calls'] += 1
+            stats['errors'] += int(bool(error))
+            stats['rows'] += rows if rows is not None and rows > 0 else 0
+            stats['time'] += elapsed
+            stats['min'] = elapsed if stats['min'] is None \
+                else min(stats['min'], elapsed)
+            stats['max'] = elapsed if stats['max'] is None \
+                else max(stats['max'], elapsed)
+            stats['histogram'].add(elapsed)
+
+    def merge(self, dump):
+        """ Add the statistics of a dump (see dump) to these ones.
+
+        :arg dump, a dictionnary returned by the dump method.
+        """
+        with self._lock:
+            for (fingerprint, other) in dump['statements'].items():
+                stats = self._get(fingerprint)
+                for key in ('calls', 'errors', 'rows', 'time'):
+                    stats[key] += other[key]
+                for (key, function) in (('min', min), ('max', max)):
+                    values = [value for value in (stats[key], other[key])
+                              if value is not None]
+                    stats[key] = function(values) if values else None
+                stats['histogram'].merge(other['histogram'])
+
+    def reset(self):
+        """ Forget all the statements recorded. """
+        with self._lock:
+            self._statements = {}
+
+    def dump(self):
+        """ Return the statistics as a dictionnary which can be written
+        in JSON: {'calls': ..., 'time': ..., 'statements': {fingerprint:
+        {'calls', 'errors', 'rows', 'time', 'min', 'max', 'p50', 'p95',
+        'p99', 'histogram'}}}, the histogram being the counts of the
+        latencies in the buckets of BUCKETS.
+        """
+        with self._lock:
+            statements = {}
+            for (fingerprint, stats) in self._statements.items():
+                entry = dict(stats)
+                histogram = entry.pop('histogram')
+                for rank in (50, 95, 99):
+                    entry['p%s' % rank] = histogram.percentile(rank)
+                entry['histogram'] = list(histogram.counts)
+                statements[fingerprint] = entry
+        return {
+            'calls': sum(entry['calls'] for entry in statements.values()),
+            'time': sum(entry['time'] for entry in statements.values()),
+            'statements': statements,
+        }
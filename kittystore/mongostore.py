@@ -16,27 +16,686 @@ license.
 """
 
 
+import copy
+import json
 import pymongo
 import re
+import threading
+from bson import json_util
+from bson.objectid import ObjectId
+from bson.son import SON
 from datetime import datetime
-from kittystore import KittyStore
+from kittystore import KittyStore, BATCH_SIZE
+from kittystore.caching import CalendarCache
+from kittystore.explain import READ_COMMANDS, call, mongo_warnings
+from kittystore.metrics import (IGNORED_KEYS, Metrics,
+    command_fingerprint)
+from kittystore.pagination import encode_token, decode_token
+from pymongo.errors import OperationFailure
+
+try:
+    from pymongo import monitoring
+except ImportError:
+    # pymongo < 3.1, no command monitoring
+    monitoring = None
+
+
+# Names of the keys of the documents for the fields of the interface
+FIELDS = {
+    'sender': 'From',
+    'email': 'Email',
+    'subject': 'Subject',
+    'content': 'Content',
+    'date': 'Date',
+    'message_id': 'MessageID',
+    'thread_id': 'ThreadID',
+    'references': 'References',
+    'in_reply_to': 'InReplyTo',
+}
+
+# Indexes used by the queries of the store, created by provision_indexes()
+INDEXES = [
+    # sorting of the archives and of the search results, keyset pagination
+    [('Date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+    # get_email
+    [('MessageID', pymongo.ASCENDING)],
+    # get_thread_length and get_thread_participants
+    [('ThreadID', pymongo.ASCENDING)],
+    # thread starters in get_archives
+    [('References', pymongo.ASCENDING),
+     ('InReplyTo', pymongo.ASCENDING),
+     ('Date', pymongo.DESCENDING)],
+]
+
+# Weighted text index used by the search_*_index methods, a match in the
+# subject weights more than in the content when sorting by textScore
+TEXT_INDEX = [('Subject', 'text'), ('Content', 'text')]
+TEXT_INDEX_OPTIONS = {
+    'name': 'Subject_Content_text',
+    'weights': {'Subject': 10, 'Content': 1},
+    'default_language': 'english',
+}
+
+
+# Clients shared by the stores of the process, keyed by (host, port,
+# metrics), the Metrics of the instrumented ones and the lists whose
+# indexes were created through each of them (see provision_indexes)
+CLIENTS = {}
+CLIENTS_METRICS = {}
+CLIENTS_PROVISIONED = {}
+CLIENTS_LOCK = threading.Lock()
+
+
+def reply_count(reply):
+    """ Return the number of documents returned or changed by a command,
+    None if unknown.
+
+    :arg reply, the reply document of the command.
+    """
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        batch = cursor.get('firstBatch', cursor.get('nextBatch'))
+        if batch is not None:
+            return len(batch)
+    value = reply.get('n')
+    return value if isinstance(value, int) else None
+
+
+class CommandRecorder(monitoring.CommandListener if monitoring
+                      else object):
+    """ Command listener recording the commands sent by a client in a
+    Metrics. The getMore commands are recorded under the fingerprint of
+    the command which opened the cursor.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        # request_id -> (fingerprint, cursor id of a getMore) of the
+        # commands running
+        self._started = {}
+        # cursor id -> fingerprint of the command which opened it
+        self._cursors = {}
+
+    def started(self, event):
+        command = event.command
+        (fingerprint, cursor_id) = (None, None)
+        if event.command_name == 'getMore':
+            cursor_id = command.get('getMore')
+            with self._lock:
+                fingerprint = self._cursors.get(cursor_id)
+            if fingerprint is not None:
+                fingerprint = '%s (getMore)' % fingerprint
+        if fingerprint is None:
+            fingerprint = command_fingerprint(
+                event.command_name, event.database_name, command)
+        with self._lock:
+            self._started[event.request_id] = (fingerprint, cursor_id)
+
+    def succeeded(self, event):
+        with self._lock:
+            (fingerprint, cursor_id) = self._started.pop(
+                event.request_id, (None, None))
+            cursor = event.reply.get('cursor')
+            if fingerprint is not None and isinstance(cursor, dict):
+                if not cursor.get('id'):
+                    # the cursor is exhausted
+                    self._cursors.pop(cursor_id, None)
+                elif cursor_id is None:
+                    self._cursors[cursor['id']] = fingerprint
+        if fingerprint is not None:
+            self.metrics.record(fingerprint, event.duration_micros / 1e6,
+                                rows=reply_count(event.reply))
+
+    def failed(self, event):
+        with self._lock:
+            (fingerprint, cursor_id) = self._started.pop(
+                event.request_id, (None, None))
+            self._cursors.pop(cursor_id, None)
+        if fingerprint is not None:
+            self.metrics.record(fingerprint, event.duration_micros / 1e6,
+                                error=True)
+
+
+class CommandCollector(monitoring.CommandListener if monitoring
+                       else object):
+    """ Command listener keeping the read commands sent by a client, as
+    (database name, command name, command) tuples, see
+    KittyMGStore.explain.
+    """
+
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name in READ_COMMANDS:
+            command = SON((key, value) for (key, value)
+                          in event.command.items()
+                          if key not in IGNORED_KEYS)
+            self.commands.append((event.database_name, event.command_name,
+                                  command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def connect(host, port, max_pool_size=None, metrics=None):
+    """ Return a new connection to a MongoDB server, using MongoClient
+    when the driver provides it (pymongo >= 2.4).
+
+    :arg host, hostname or IP of the database server.
+    :arg port, port of the database server.
+    :kwarg max_pool_size, maximum number of sockets kept open, defaults
+    to the one of the driver.
+    :kwarg metrics, a Metrics in which the commands sent by the client
+    are recorded, this needs pymongo >= 3.1.
+    """
+    options = {}
+    if metrics is not None:
+        if monitoring is None:
+            raise ImportError('The metrics need pymongo >= 3.1')
+        options['event_listeners'] = [CommandRecorder(metrics)]
+    if hasattr(pymongo, 'MongoClient'):
+        if max_pool_size is not None:
+            options['maxPoolSize'] = max_pool_size
+        return pymongo.MongoClient(host, port, **options)
+    if max_pool_size is not None:
+        options['max_pool_size'] = max_pool_size
+    return pymongo.Connection(host, port, **options)
+
+
+def get_client(host, port, max_pool_size=None, metrics=False):
+    """ Return the client of the process for a given server, creating it
+    the first time. The pool options are only used at that time.
+
+    :arg host, hostname or IP of the database server.
+    :arg port, port of the database server.
+    :kwarg max_pool_size, maximum number of sockets kept open.
+    :kwarg metrics, a boolean to use the client recording its commands,
+    its Metrics are in CLIENTS_METRICS.
+    """
+    key = (host, port, metrics)
+    with CLIENTS_LOCK:
+        if key not in CLIENTS:
+            if metrics:
+                CLIENTS_METRICS[key] = Metrics()
+            CLIENTS[key] = connect(host, port, max_pool_size,
+                                   metrics=CLIENTS_METRICS.get(key))
+            CLIENTS_PROVISIONED[key] = {}
+        return CLIENTS[key]
+
+
+def close_clients():
+    """ Close the connections of all the shared clients and forget them.
+    """
+    with CLIENTS_LOCK:
+        while CLIENTS:
+            CLIENTS.popitem()[1].close()
+        CLIENTS_METRICS.clear()
+        CLIENTS_PROVISIONED.clear()
+
+
+def search_query(fields, keyword, case_sensitive=False):
+    """ Return the query document matching the emails containing the
+    specified keyword in any of the given fields.
+
+    :arg fields, list of the fields in which the keyword is searched.
+    :arg keyword, keyword to search in the database.
+    :kwarg case_sensitive, a boolean stipulating whether the search is
+    case sensitive or not.
+    """
+    regex = '.*%s.*' % keyword
+    if case_sensitive:
+        regex = re.compile(regex)
+    else:
+        regex = re.compile(regex, re.IGNORECASE)
+    if len(fields) == 1:
+        return {fields[0]: regex}
+    return {'$or': [{field: regex} for field in fields]}
+
+
+def projection(fields, required=None):
+    """ Return the projection document loading only the given fields, or
+    None to load the whole documents.
+
+    :arg fields, list of the fields to load using the names of the
+    KittyStore interface (see FIELDS), None to load all of them.
+    :kwarg required, list of the document keys always loaded.
+    """
+    if fields is None:
+        return None
+    keys = [FIELDS.get(field, field) for field in fields]
+    keys.extend(required or [])
+    return dict((key, True) for key in keys)
+
+
+def count(collection, query_string):
+    """ Return the number of documents of a collection matching a query,
+    using count_documents when the driver provides it (pymongo >= 3.7).
+
+    :arg collection, the collection to query.
+    :arg query_string, the query document.
+    """
+    if hasattr(collection, 'count_documents'):
+        return collection.count_documents(query_string)
+    return collection.find(query_string).count()
+
+
+def aggregate(collection, pipeline):
+    """ Return the list of the documents output by an aggregation
+    pipeline, whatever the version of pymongo (a dictionnary is returned
+    before 3.0, a cursor after).
+
+    :arg collection, the collection to query.
+    :arg pipeline, the list of the stages of the pipeline.
+    """
+    result = collection.aggregate(pipeline)
+    if isinstance(result, dict):
+        return result['result']
+    return list(result)
+
+
+def update(collection, spec, document, upsert=False, multi=False):
+    """ Update the first document of a collection matching a query,
+    using update_one when the driver provides it (pymongo >= 3.0).
+
+    :arg collection, the collection to update.
+    :arg spec, the query document selecting the document to update.
+    :arg document, the modifications to apply.
+    :kwarg upsert, a boolean stipulating whether the document should be
+    inserted if none matches the query.
+    :kwarg multi, a boolean to update all the documents matching the
+    query instead of the first one (update_many).
+    """
+    if hasattr(collection, 'update_one'):
+        if multi:
+            return collection.update_many(spec, document, upsert=upsert)
+        return collection.update_one(spec, document, upsert=upsert)
+    return collection.update(spec, document, upsert=upsert, multi=multi)
+
+
+def delete(collection, spec):
+    """ Delete the first document of a collection matching a query,
+    using delete_one when the driver provides it (pymongo >= 3.0).
+
+    :arg collection, the collection to delete from.
+    :arg spec, the query document selecting the document to delete.
+    """
+    if hasattr(collection, 'delete_one'):
+        return collection.delete_one(spec)
+    return collection.remove(spec, multi=False)
+
+
+def collection_names(database):
+    """ Return the names of the collections of a database, using
+    list_collection_names when the driver provides it (pymongo >= 3.6).
+
+    :arg database, the database.
+    """
+    if hasattr(database, 'list_collection_names'):
+        return database.list_collection_names()
+    return database.collection_names()
+
+
+def to_document(email):
+    """ Return the MongoDB document of an email given as a dictionnary
+    keyed by the column names of kittysamodel.get_table (see FIELDS).
+    The empty fields are left out of the document.
+
+    :arg email, a dictionnary holding the fields of the email.
+    """
+    return dict((FIELDS.get(key, key), value)
+                for (key, value) in email.items() if value is not None)
+
+
+def thread_summary_pipeline(thread_id=None):
+    """ Return the aggregation pipeline computing the summary of the
+    threads of a list: number of emails, participants, date of the
+    first and last emails and MessageID of the email starting the
+    thread.
+
+    :kwarg thread_id, unique identifier of the thread to summarize,
+    defaults to all the threads.
+    """
+    pipeline = []
+    if thread_id is not None:
+        pipeline.append({'$match': {'ThreadID': thread_id}})
+    # Beginning of thread == No 'References' header
+    starter = {'$and': [
+        {'$eq': [{'$ifNull': ['$References', None]}, None]},
+        {'$eq': [{'$ifNull': ['$InReplyTo', None]}, None]},
+        ]}
+    pipeline.append({'$group': {
+        '_id': '$ThreadID',
+        'length': {'$sum': 1},
+        'participants': {'$addToSet': '$From'},
+        'first_date': {'$min': '$Date'},
+        'last_date': {'$max': '$Date'},
+        'starter': {'$max': {'$cond': [starter, '$MessageID', None]}},
+        }})
+    return pipeline
+
+
+def thread_summary_changes(documents):
+    """ Return the modifications to apply to the thread summaries when
+    adding emails, as a dictionnary {ThreadID: update document}, each
+    thread being updated once.
+
+    :arg documents, the documents of the emails.
+    """
+    threads = {}
+    for document in documents:
+        changes = threads.setdefault(document['ThreadID'], {
+            '$inc': {'length': 0},
+            '$addToSet': {'participants': {'$each': []}},
+            })
+        changes['$inc']['length'] += 1
+        participants = changes['$addToSet']['participants']['$each']
+        if document['From'] not in participants:
+            participants.append(document['From'])
+        if 'Date' in document:
+            first = changes.setdefault('$min',
+                                       {'first_date': document['Date']})
+            first['first_date'] = min(first['first_date'], document['Date'])
+            last = changes.setdefault('$max',
+                                      {'last_date': document['Date']})
+            last['last_date'] = max(last['last_date'], document['Date'])
+        if 'References' not in document and 'InReplyTo' not in document:
+            changes['$set'] = {'starter': document['MessageID']}
+    return threads
+
+
+def page_query(query_string, token):
+    """ Return the query document selecting the emails of the page
+    starting after the email pointed by a token, the emails being sorted
+    by Date and _id, most recent first.
+
+    :arg query_string, the query document of the search.
+    :arg token, continuation token returned with the previous page, None
+    for the first page.
+    """
+    criteria = [query_string, {'Date': {'$exists': True}}]
+    if token is not None:
+        (date, mail_id) = decode_token(token)
+        if ObjectId.is_valid(mail_id):
+            mail_id = ObjectId(mail_id)
+        # the top-level bound gives the planner an index range on Date,
+        # the $or alone is not turned into one
+        criteria.append({'Date': {'$lte': date}})
+        criteria.append({'$or': [
+            {'Date': {'$lt': date}},
+            {'Date': date, '_id': {'$lt': mail_id}},
+            ]})
+    return {'$and': criteria}
 
 
 class KittyMGStore(KittyStore):
     """ Implementation of the store for a MongoDB backend. """
 
-    def __init__(self, host='localhost', port=27017):
+    def __init__(self, host='localhost', port=27017, pooled=False,
+                 max_pool_size=None, metrics=False):
         """ Constructor.
         Create the session using the engine defined in the url.
 
         :arg host, hostname or IP of the database server. Defaults to
         'localhost'
         :arg port, port of the database server. Defaults to '27017'
-        :kwarg debug, a boolean to set the debug mode on or off.
+        :kwarg pooled, a boolean to use the client shared by the stores
+        of the process for this server (see get_client) rather than one
+        of its own.
+        :kwarg max_pool_size, maximum number of sockets kept open by the
+        client, used if it is created.
+        :kwarg metrics, a boolean to record the commands sent by the
+        client (see metrics), this needs pymongo >= 3.1.
+        """
+        self.pooled = pooled
+        # lists for which the indexes have already been created through
+        # the client, with the error raised by the text index if any
+        # (see provision_indexes)
+        if pooled:
+            self.connection = get_client(host, port, max_pool_size,
+                                         metrics=metrics)
+            self._metrics = CLIENTS_METRICS.get((host, port, metrics))
+            self.provisioned = CLIENTS_PROVISIONED.get(
+                (host, port, metrics), {})
+        else:
+            self._metrics = Metrics() if metrics else None
+            self.connection = connect(host, port, max_pool_size,
+                                      metrics=self._metrics)
+            self.provisioned = {}
+        # lists known to have a thread summary, see has_thread_summary
+        self.thread_summaries = {}
+        # archive calendar of the lists, see get_archive_calendar
+        self.calendars = CalendarCache()
+
+    def metrics(self, reset=False):
+        """ Return the statistics of the commands sent by the client of
+        the store (see kittystore.metrics.Metrics.dump), None if the
+        store was created without metrics.
+
+        :kwarg reset, a boolean to forget the commands recorded so far
+        once returned.
+        """
+        if self._metrics is None:
+            return None
+        dump = self._metrics.dump()
+        if reset:
+            self._metrics.reset()
+        return dump
+
+    def explain(self, method, *args, **kwargs):
+        """ Call a method of the store and return the plan of each of the
+        read commands it sent, as a list of dictionnaries with the keys
+        statement, plan (explain with the executionStats verbosity) and
+        warnings (collection scans, in-memory sorts).
+
+        The method is called on a copy of the store using a client of
+        its own, which collects the commands, so the store itself can
+        still be used by other threads. This needs pymongo >= 3.1.
+
+        :arg method, the name of the method called.
+        :arg args, the arguments of the method.
+        :arg kwargs, the keyword arguments of the method.
+        """
+        if monitoring is None:
+            raise ImportError('The query plans need pymongo >= 3.1')
+        collector = CommandCollector()
+        (host, port) = self.connection.address
+        client = pymongo.MongoClient(host, port,
+                                     event_listeners=[collector])
+        store = copy.copy(self)
+        store.connection = client
+        try:
+            call(getattr(store, method), *args, **kwargs)
+            plans = []
+            for (database_name, command_name, command) in \
+                    collector.commands:
+                explain = client[database_name].command(
+                    'explain', command, verbosity='executionStats')
+                # turn the BSON types (regex, dates...) into JSON
+                explain = json.loads(json_util.dumps(explain))
+                plans.append({
+                    'statement': command_fingerprint(
+                        command_name, database_name, command),
+                    'plan': explain,
+                    'warnings': mongo_warnings(explain)})
+        finally:
+            client.close()
+        return plans
+
+    def provision_indexes(self, list_name):
+        """ Create the indexes needed by the queries for a given list.
+        This is done once per list and client, the queries
+        themselves never create any index.
+
+        The text index needs MongoDB >= 2.6, if it cannot be created the
+        other indexes are kept and the search_*_index methods raise
+        NotImplementedError.
+
+        :arg list_name, name of the mailing list for which the indexes
+        should be created.
+        """
+        if list_name in self.provisioned:
+            return
+        mongodb = self.connection[list_name]
+        for index in INDEXES:
+            mongodb.mails.create_index(index)
+        try:
+            mongodb.mails.create_index(TEXT_INDEX, **TEXT_INDEX_OPTIONS)
+            error = None
+        except OperationFailure as err:
+            error = err
+        self.provisioned[list_name] = error
+
+    def has_thread_summary(self, list_name):
+        """ Return whether a given mailing list has a thread summary, in
+        its `threads` collection (see add_thread_summary). The database
+        is checked until the summary is found, another store may add it
+        at any time.
+
+        :arg list_name, name of the mailing list.
         """
-        self.connection = pymongo.Connection(host, port)
+        if list_name not in self.thread_summaries:
+            mongodb = self.connection[list_name]
+            if 'threads' in collection_names(mongodb):
+                self.thread_summaries[list_name] = True
+        return self.thread_summaries.get(list_name, False)
+
+    def add_thread_summary(self, list_name):
+        """ Build the thread summary of a given mailing list from its
+        emails. The summary is then kept current by add_email
+        and add_emails.
+
+        Each document of the `threads` collection has the ThreadID as
+        _id, the number of emails (length), the list of the participants,
+        the date of the first and last emails and the MessageID of the
+        email starting the thread.
+
+        :arg list_name, name of the mailing list.
+        """
+        mongodb = self.connection[list_name]
+        aggregate(mongodb.mails,
+                  thread_summary_pipeline() + [{'$out': 'threads'}])
+        self.thread_summaries[list_name] = True
+
+    def rebuild_thread_summary(self, list_name, thread_id):
+        """ Recompute the summary of one thread of a given mailing list
+        from its emails.
+
+        :arg list_name, name of the mailing list.
+        :arg thread_id, unique identifier of the thread to recompute.
+        """
+        mongodb = self.connection[list_name]
+        summary = aggregate(mongodb.mails, thread_summary_pipeline(thread_id))
+        if summary:
+            summary = summary[0]
+            del summary['_id']
+            update(mongodb.threads, {'_id': thread_id}, {'$set': summary},
+                   upsert=True)
+        else:
+            delete(mongodb.threads, {'_id': thread_id})
+
+    def merge_threads(self, list_name, thread_ids, thread_id):
+        """ Move the emails of some threads into another one, and update
+        the thread summary, if any.
+
+        :arg list_name, name of the mailing list.
+        :arg thread_ids, unique identifiers of the threads merged.
+        :arg thread_id, unique identifier of the thread they are merged
+        into.
+        """
+        mongodb = self.connection[list_name]
+        update(mongodb.mails, {'ThreadID': {'$in': list(thread_ids)}},
+               {'$set': {'ThreadID': thread_id}}, multi=True)
+        if self.has_thread_summary(list_name):
+            for identifier in [thread_id] + list(thread_ids):
+                self.rebuild_thread_summary(list_name, identifier)
+
+    def get_thread_index(self, list_name, batch_size=BATCH_SIZE):
+        """ Return an iterator over the (message_id, thread_id) tuples of
+        all the emails of a given mailing list (see threader.Threader).
 
-    def get_archives(self, list_name, start, end):
+        :arg list_name, name of the mailing list.
+        :kwarg batch_size, number of documents fetched per round trip.
+        """
+        mongodb = self.connection[list_name]
+        cursor = mongodb.mails.find({}, {'MessageID': 1, 'ThreadID': 1,
+                                         '_id': 0}).batch_size(batch_size)
+        return ((email['MessageID'], email['ThreadID']) for email in cursor)
+
+    def add_email(self, list_name, email):
+        """ Store an email in the database of a given mailing list and
+        update the summary of its thread, if the list has one.
+
+        :arg list_name, name of the mailing list in which this email
+        should be stored.
+        :arg email, a dictionnary holding the fields of the email, keyed
+        by the column names of kittysamodel.get_table.
+        """
+        document = to_document(email)
+        mongodb = self.connection[list_name]
+        if hasattr(mongodb.mails, 'insert_one'):
+            mongodb.mails.insert_one(document)
+        else:
+            mongodb.mails.insert(document)
+        self._update_summaries(list_name, [document])
+        return document
+
+    def add_emails(self, list_name, emails):
+        """ Store a batch of emails in the database of a given mailing
+        list with a single unordered insert, then update the summary of
+        each of their threads once, if the list has one.
+
+        When some of the emails are rejected (e.g. a duplicated
+        MessageID), the summaries are updated with the other ones before
+        the BulkWriteError is raised.
+
+        :arg list_name, name of the mailing list in which these emails
+        should be stored.
+        :arg emails, a list of dictionnaries holding the fields of the
+        emails, keyed by the column names of kittysamodel.get_table.
+        """
+        if not emails:
+            return
+        documents = [to_document(email) for email in emails]
+        mongodb = self.connection[list_name]
+        try:
+            if hasattr(mongodb.mails, 'insert_many'):
+                mongodb.mails.insert_many(documents, ordered=False)
+            else:
+                mongodb.mails.insert(documents, continue_on_error=True)
+        except OperationFailure as err:
+            details = err.details or {}
+            if 'writeErrors' not in details:
+                # not a bulk write error, the emails inserted are unknown
+                raise
+            failed = set(error['index'] for error in details['writeErrors'])
+            self._update_summaries(list_name, [
+                document for (index, document) in enumerate(documents)
+                if index not in failed])
+            raise
+        self._update_summaries(list_name, documents)
+
+    def _update_summaries(self, list_name, documents):
+        """ Update the thread summaries and the archive calendar of a list
+        with newly stored emails, each thread being updated once.
+
+        :arg list_name, name of the mailing list.
+        :arg documents, the documents of the emails.
+        """
+        mongodb = self.connection[list_name]
+        if self.has_thread_summary(list_name):
+            for (thread_id, changes) in thread_summary_changes(
+                    documents).items():
+                update(mongodb.threads, {'_id': thread_id}, changes,
+                       upsert=True)
+        self.calendars.add(list_name,
+                           [document.get('Date') for document in documents])
+
+    def get_archives(self, list_name, start, end, fields=None):
         """ Return all the thread started emails between two given dates.
         
         :arg list_name, name of the mailing list in which this email
@@ -45,18 +704,17 @@ class KittyMGStore(KittyStore):
         the interval to query.
         :arg end, a datetime object representing the ending date of
         the interval to query.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
         """
         mongodb = self.connection[list_name]
-        mongodb.mails.create_index('Date')
-        mongodb.mails.ensure_index('Date')
-        mongodb.mails.create_index('References')
-        mongodb.mails.ensure_index('References')
         # Beginning of thread == No 'References' header
         archives = []
         for email in mongodb.mails.find(
                 {'References': {'$exists':False},
                 'InReplyTo': {'$exists':False},
-                "Date": {"$gt": start, "$lt": end}}, 
+                "Date": {"$gt": start, "$lt": end}},
+                projection(fields),
                 sort=[('Date', pymongo.DESCENDING)]):
             archives.append(email)
         return archives
@@ -70,8 +728,6 @@ class KittyMGStore(KittyStore):
         should be searched.
         """
         mongodb = self.connection[list_name]
-        mongodb.mails.create_index('Date')
-        mongodb.mails.ensure_index('Date')
         archives = {}
         entry = mongodb.mails.find_one(sort=[('Date', pymongo.ASCENDING)])
         date = entry['Date']
@@ -85,6 +741,32 @@ class KittyMGStore(KittyStore):
         archives[now.year] = range(1, 13)[:now.month]
         return archives
 
+    def get_archive_calendar(self, list_name):
+        """ Return a dictionnary of years, months and number of emails
+        for the months in which emails were posted on a given list:
+        {year: {month: count}}.
+        The calendar is kept for caching.CALENDAR_TTL seconds and kept
+        current by add_email and add_emails meanwhile.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        """
+        calendar = self.calendars.get(list_name)
+        if calendar is None:
+            mongodb = self.connection[list_name]
+            calendar = {}
+            for bucket in aggregate(mongodb.mails, [
+                    {'$match': {'Date': {'$exists': True}}},
+                    {'$group': {
+                        '_id': {'year': {'$year': '$Date'},
+                                'month': {'$month': '$Date'}},
+                        'count': {'$sum': 1}}},
+                    ]):
+                calendar.setdefault(bucket['_id']['year'], {})[
+                    bucket['_id']['month']] = bucket['count']
+            calendar = self.calendars.set(list_name, calendar)
+        return calendar
+
     def get_email(self, list_name, message_id):
         """ Return an Email object found in the database corresponding
         to the Message-ID provided.
@@ -95,8 +777,6 @@ class KittyMGStore(KittyStore):
         Used here to uniquely identify the email present in the database.
         """
         mongodb = self.connection[list_name]
-        mongodb.mails.create_index('MessageID')
-        mongodb.mails.ensure_index('MessageID')
         return mongodb.mails.find_one({'MessageID': message_id})
 
     def get_list_size(self, list_name):
@@ -106,11 +786,16 @@ class KittyMGStore(KittyStore):
         should be searched.
         """
         mongodb = self.connection[list_name]
+        if hasattr(mongodb.mails, 'estimated_document_count'):
+            # pymongo >= 3.7, read from the collection metadata
+            return mongodb.mails.estimated_document_count()
         return mongodb.mails.count()
 
     def get_thread_length(self, list_name, thread_id):
         """ Return the number of email present in a thread. This thread
         is uniquely identified by its thread_id.
+        The answer comes from the thread summary when the list has one
+        (see add_thread_summary).
 
         :arg list_name, name of the mailing list in which this email
         should be searched.
@@ -118,13 +803,35 @@ class KittyMGStore(KittyStore):
         the database.
         """
         mongodb = self.connection[list_name]
-        mongodb.mails.create_index('ThreadID')
-        mongodb.mails.ensure_index('ThreadID')
-        return mongodb.mails.find({'ThreadID': thread_id}).count()
+        if self.has_thread_summary(list_name):
+            thread = mongodb.threads.find_one({'_id': thread_id},
+                                              {'length': True})
+            return thread['length'] if thread else 0
+        return count(mongodb.mails, {'ThreadID': thread_id})
 
     def get_thread_participants(self, list_name, thread_id):
         """ Return the list of participant in a thread. This thread
         is uniquely identified by its thread_id.
+        The answer comes from the thread summary when the list has one
+        (see add_thread_summary).
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg thread_id, unique identifier of the thread as specified in
+        the database.
+        """
+        mongodb = self.connection[list_name]
+        if self.has_thread_summary(list_name):
+            thread = mongodb.threads.find_one({'_id': thread_id},
+                                              {'participants': True})
+            return set(thread['participants']) if thread else set()
+        return set(mongodb.mails.find({'ThreadID': thread_id}).distinct(
+            'From'))
+
+    def get_thread_stats(self, list_name, thread_id):
+        """ Return the number of email present in a thread and the list of
+        its participants, as a tuple (length, participants), in a single
+        round trip. This thread is uniquely identified by its thread_id.
 
         :arg list_name, name of the mailing list in which this email
         should be searched.
@@ -132,51 +839,45 @@ class KittyMGStore(KittyStore):
         the database.
         """
         mongodb = self.connection[list_name]
-        mongodb.mails.create_index('ThreadID')
-        mongodb.mails.ensure_index('ThreadID')
-        authors = set()
-        for mail in mongodb.mails.find({'ThreadID': thread_id}):
-            authors.add(mail['From'])
-        return authors
-
-    def search_content(self, list_name, keyword):
+        if self.has_thread_summary(list_name):
+            thread = mongodb.threads.find_one({'_id': thread_id},
+                {'length': True, 'participants': True})
+        else:
+            thread = aggregate(mongodb.mails,
+                               thread_summary_pipeline(thread_id))
+            thread = thread[0] if thread else None
+        if thread is None:
+            return (0, set())
+        return (thread['length'], set(thread['participants']))
+
+    def search_content(self, list_name, keyword, fields=None):
         """ Returns a list of email containing the specified keyword in
         their content.
 
         :arg list_name, name of the mailing list in which this email
         should be searched.
         :arg keyword, keyword to search in the content of the emails.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
         """
-        mongodb = self.connection[list_name]
-        mongodb.mails.create_index('Date')
-        mongodb.mails.ensure_index('Date')
-        mongodb.mails.create_index('Content')
-        mongodb.mails.ensure_index('Content')
-        regex = '.*%s.*' % keyword
-        query_string = {'Content': re.compile(regex, re.IGNORECASE)}
-        return list(mongodb.mails.find(query_string, sort=[('Date',
-            pymongo.DESCENDING)]))
-
-    def search_content_cs(self, list_name, keyword):
+        query_string = search_query(['Content'], keyword)
+        return list(self._search(list_name, query_string, fields))
+
+    def search_content_cs(self, list_name, keyword, fields=None):
         """ Returns a list of email containing the specified keyword in
         their content.
 
         :arg list_name, name of the mailing list in which this email
         should be searched.
         :arg keyword, keyword to search in the content of the emails.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
         """
-        mongodb = self.connection[list_name]
-        mongodb.mails.create_index('Date')
-        mongodb.mails.ensure_index('Date')
-        mongodb.mails.create_index('Content')
-        mongodb.mails.ensure_index('Content')
-        regex = '.*%s.*' % keyword
-        query_string = {'Content': re.compile(regex)}
-        return list(mongodb.mails.find(query_string, sort=[('Date',
-            pymongo.DESCENDING)]))
+        query_string = search_query(['Content'], keyword, case_sensitive=True)
+        return list(self._search(list_name, query_string, fields))
 
     def search_content_subject(self, list_name, keyword, limit=None,
-                               offset=None):
+                               offset=None, fields=None):
         """ Returns a list of email containing the specified keyword in
         their content or their subject.
 
@@ -184,28 +885,17 @@ class KittyMGStore(KittyStore):
         should be searched.
         :arg keyword, keyword to search in the content or subject of
         the emails.
+        :kwarg limit, maximum number of emails returned.
+        :kwarg offset, number of emails skipped when a limit is given.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
         """
-        mongodb = self.connection[list_name]
-        mongodb.mails.create_index('Date')
-        mongodb.mails.ensure_index('Date')
-        mongodb.mails.create_index('Content')
-        mongodb.mails.ensure_index('Content')
-        mongodb.mails.create_index('Subject')
-        mongodb.mails.ensure_index('Subject')
-        regex = '.*%s.*' % keyword
-        query_string = {'$or' : [
-            {'Content': re.compile(regex, re.IGNORECASE)},
-            {'Subject': re.compile(regex, re.IGNORECASE)}
-            ]}
-        cursor = mongodb.mails.find(query_string,
-                                    sort=[('Date',
-                                           pymongo.DESCENDING)])
-        if limit is not None:
-            cursor = cursor.skip(offset).limit(limit)
+        query_string = search_query(['Content', 'Subject'], keyword)
+        return self._search_limit(list_name, query_string, limit, offset,
+                                  fields)
 
-        return list(cursor)
-
-    def search_content_subject_cs(self, list_name, keyword):
+    def search_content_subject_cs(self, list_name, keyword, limit=None,
+                                  offset=None, fields=None):
         """ Returns a list of email containing the specified keyword in
         their content or their subject.
 
@@ -213,100 +903,468 @@ class KittyMGStore(KittyStore):
         should be searched.
         :arg keyword, keyword to search in the content or subject of
         the emails.
+        :kwarg limit, maximum number of emails returned.
+        :kwarg offset, number of emails skipped when a limit is given.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
         """
-        mongodb = self.connection[list_name]
-        mongodb.mails.create_index('Date')
-        mongodb.mails.ensure_index('Date')
-        mongodb.mails.create_index('Content')
-        mongodb.mails.ensure_index('Content')
-        mongodb.mails.create_index('Subject')
-        mongodb.mails.ensure_index('Subject')
-        regex = '.*%s.*' % keyword
-        query_string = {'$or' : [
-            {'Content': re.compile(regex)},
-            {'Subject': re.compile(regex)}
-            ]}
-        return list(mongodb.mails.find(query_string, sort=[('Date',
-            pymongo.DESCENDING)]))
-
-    def search_sender(self, list_name, keyword):
+        query_string = search_query(['Content', 'Subject'], keyword,
+            case_sensitive=True)
+        return self._search_limit(list_name, query_string, limit, offset,
+                                  fields)
+
+    def search_sender(self, list_name, keyword, limit=None,
+                      offset=None, fields=None):
         """ Returns a list of email containing the specified keyword in
         the name or email address of the sender of the email.
 
         :arg list_name, name of the mailing list in which this email
         should be searched.
         :arg keyword, keyword to search in the database.
+        :kwarg limit, maximum number of emails returned.
+        :kwarg offset, number of emails skipped when a limit is given.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
         """
-        mongodb = self.connection[list_name]
-        mongodb.mails.create_index('Date')
-        mongodb.mails.ensure_index('Date')
-        mongodb.mails.create_index('From')
-        mongodb.mails.ensure_index('From')
-        mongodb.mails.create_index('Email')
-        mongodb.mails.ensure_index('Email')
-        regex = '.*%s.*' % keyword
-        query_string = {'$or' : [
-            {'From': re.compile(regex, re.IGNORECASE)},
-            {'Email': re.compile(regex, re.IGNORECASE)}
-            ]}
-        return list(mongodb.mails.find(query_string, sort=[('Date',
-            pymongo.DESCENDING)]))
-
-    def search_sender_cs(self, list_name, keyword):
+        query_string = search_query(['From', 'Email'], keyword)
+        return self._search_limit(list_name, query_string, limit, offset,
+                                  fields)
+
+    def search_sender_cs(self, list_name, keyword, limit=None,
+                         offset=None, fields=None):
         """ Returns a list of email containing the specified keyword in
         the name or email address of the sender of the email.
 
         :arg list_name, name of the mailing list in which this email
         should be searched.
         :arg keyword, keyword to search in the database.
+        :kwarg limit, maximum number of emails returned.
+        :kwarg offset, number of emails skipped when a limit is given.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
         """
-        mongodb = self.connection[list_name]
-        mongodb.mails.create_index('Date')
-        mongodb.mails.ensure_index('Date')
-        mongodb.mails.create_index('From')
-        mongodb.mails.ensure_index('From')
-        mongodb.mails.create_index('Email')
-        mongodb.mails.ensure_index('Email')
-        regex = '.*%s.*' % keyword
-        query_string = {'$or' : [
-            {'From': re.compile(regex)},
-            {'Email': re.compile(regex)}
-            ]}
-        return list(mongodb.mails.find(query_string, sort=[('Date',
-            pymongo.DESCENDING)]))
-
-    def search_subject(self, list_name, keyword):
+        query_string = search_query(['From', 'Email'], keyword,
+            case_sensitive=True)
+        return self._search_limit(list_name, query_string, limit, offset,
+                                  fields)
+
+    def search_subject(self, list_name, keyword, fields=None):
         """ Returns a list of email containing the specified keyword in
         their subject.
 
         :arg list_name, name of the mailing list in which this email
         should be searched.
         :arg keyword, keyword to search in the subject of the emails.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
         """
-        mongodb = self.connection[list_name]
-        mongodb.mails.create_index('Date')
-        mongodb.mails.ensure_index('Date')
-        mongodb.mails.create_index('Subject')
-        mongodb.mails.ensure_index('Subject')
-        regex = '.*%s.*' % keyword
-        query_string = {'Subject': re.compile(regex, re.IGNORECASE)}
-        return list(mongodb.mails.find(query_string, sort=[('Date',
-            pymongo.DESCENDING)]))
-
-    def search_subject_cs(self, list_name, keyword):
+        query_string = search_query(['Subject'], keyword)
+        return list(self._search(list_name, query_string, fields))
+
+    def search_subject_cs(self, list_name, keyword, fields=None):
         """ Returns a list of email containing the specified keyword in
         their subject.
 
         :arg list_name, name of the mailing list in which this email
         should be searched.
         :arg keyword, keyword to search in the subject of the emails.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['Subject'], keyword, case_sensitive=True)
+        return list(self._search(list_name, query_string, fields))
+
+    def search_content_index(self, list_name, keyword, limit=None,
+                             offset=None, fields=None):
+        """ Returns a list of email containing the specified keyword in
+        their content, using the text index, most relevant first.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content of the emails.
+        :kwarg limit, maximum number of emails returned.
+        :kwarg offset, number of emails skipped when a limit is given.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        return self._search_text(list_name, keyword, 'Content', limit,
+                                 offset, fields)
+
+    def search_content_subject_index(self, list_name, keyword, limit=None,
+                                     offset=None, fields=None):
+        """ Returns a list of email containing the specified keyword in
+        their content or their subject, using the text index, most
+        relevant first.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content or subject of
+        the emails.
+        :kwarg limit, maximum number of emails returned.
+        :kwarg offset, number of emails skipped when a limit is given.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        return self._search_text(list_name, keyword, None, limit, offset,
+                                 fields)
+
+    def search_subject_index(self, list_name, keyword, limit=None,
+                             offset=None, fields=None):
+        """ Returns a list of email containing the specified keyword in
+        their subject, using the text index, most relevant first.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the subject of the emails.
+        :kwarg limit, maximum number of emails returned.
+        :kwarg offset, number of emails skipped when a limit is given.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        return self._search_text(list_name, keyword, 'Subject', limit,
+                                 offset, fields)
+
+    def iter_search_content(self, list_name, keyword, batch_size=BATCH_SIZE,
+                            fields=None):
+        """ Returns an iterator over the emails containing the specified
+        keyword in their content.
+        The emails are fetched from the server by batches of `batch_size`.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content of the emails.
+        :kwarg batch_size, number of emails fetched per round trip.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['Content'], keyword)
+        cursor = self._search(list_name, query_string, fields)
+        return cursor.batch_size(batch_size)
+
+    def iter_search_content_cs(self, list_name, keyword,
+                               batch_size=BATCH_SIZE, fields=None):
+        """ Returns an iterator over the emails containing the specified
+        keyword in their content (case sensitive).
+        The emails are fetched from the server by batches of `batch_size`.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content of the emails.
+        :kwarg batch_size, number of emails fetched per round trip.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['Content'], keyword, case_sensitive=True)
+        cursor = self._search(list_name, query_string, fields)
+        return cursor.batch_size(batch_size)
+
+    def iter_search_content_subject(self, list_name, keyword,
+                                    batch_size=BATCH_SIZE, fields=None):
+        """ Returns an iterator over the emails containing the specified
+        keyword in their content or their subject.
+        The emails are fetched from the server by batches of `batch_size`.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content or subject of
+        the emails.
+        :kwarg batch_size, number of emails fetched per round trip.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['Content', 'Subject'], keyword)
+        cursor = self._search(list_name, query_string, fields)
+        return cursor.batch_size(batch_size)
+
+    def iter_search_content_subject_cs(self, list_name, keyword,
+                                       batch_size=BATCH_SIZE, fields=None):
+        """ Returns an iterator over the emails containing the specified
+        keyword in their content or their subject (case sensitive).
+        The emails are fetched from the server by batches of `batch_size`.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content or subject of
+        the emails.
+        :kwarg batch_size, number of emails fetched per round trip.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['Content', 'Subject'], keyword,
+            case_sensitive=True)
+        cursor = self._search(list_name, query_string, fields)
+        return cursor.batch_size(batch_size)
+
+    def iter_search_sender(self, list_name, keyword, batch_size=BATCH_SIZE,
+                           fields=None):
+        """ Returns an iterator over the emails containing the specified
+        keyword in the name or email address of their sender.
+        The emails are fetched from the server by batches of `batch_size`.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the database.
+        :kwarg batch_size, number of emails fetched per round trip.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['From', 'Email'], keyword)
+        cursor = self._search(list_name, query_string, fields)
+        return cursor.batch_size(batch_size)
+
+    def iter_search_sender_cs(self, list_name, keyword, batch_size=BATCH_SIZE,
+                              fields=None):
+        """ Returns an iterator over the emails containing the specified
+        keyword in the name or email address of their sender (case
+        sensitive).
+        The emails are fetched from the server by batches of `batch_size`.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the database.
+        :kwarg batch_size, number of emails fetched per round trip.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['From', 'Email'], keyword,
+            case_sensitive=True)
+        cursor = self._search(list_name, query_string, fields)
+        return cursor.batch_size(batch_size)
+
+    def iter_search_subject(self, list_name, keyword, batch_size=BATCH_SIZE,
+                            fields=None):
+        """ Returns an iterator over the emails containing the specified
+        keyword in their subject.
+        The emails are fetched from the server by batches of `batch_size`.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the subject of the emails.
+        :kwarg batch_size, number of emails fetched per round trip.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['Subject'], keyword)
+        cursor = self._search(list_name, query_string, fields)
+        return cursor.batch_size(batch_size)
+
+    def iter_search_subject_cs(self, list_name, keyword,
+                               batch_size=BATCH_SIZE, fields=None):
+        """ Returns an iterator over the emails containing the specified
+        keyword in their subject (case sensitive).
+        The emails are fetched from the server by batches of `batch_size`.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the subject of the emails.
+        :kwarg batch_size, number of emails fetched per round trip.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['Subject'], keyword, case_sensitive=True)
+        cursor = self._search(list_name, query_string, fields)
+        return cursor.batch_size(batch_size)
+
+    def page_search_content(self, list_name, keyword, limit=30, token=None,
+                            fields=None):
+        """ Returns a page of the emails containing the specified keyword
+        in their content.
+        Returns a tuple (emails, token), see KittyStore.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content of the emails.
+        :kwarg limit, number of emails per page.
+        :kwarg token, continuation token returned with the previous page.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['Content'], keyword)
+        return self._page(list_name, query_string, limit, token, fields)
+
+    def page_search_content_subject(self, list_name, keyword, limit=30,
+                                    token=None, fields=None):
+        """ Returns a page of the emails containing the specified keyword
+        in their content or their subject.
+        Returns a tuple (emails, token), see KittyStore.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content or subject of
+        the emails.
+        :kwarg limit, number of emails per page.
+        :kwarg token, continuation token returned with the previous page.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['Content', 'Subject'], keyword)
+        return self._page(list_name, query_string, limit, token, fields)
+
+    def page_search_sender(self, list_name, keyword, limit=30, token=None,
+                           fields=None):
+        """ Returns a page of the emails containing the specified keyword
+        in the name or email address of their sender.
+        Returns a tuple (emails, token), see KittyStore.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the database.
+        :kwarg limit, number of emails per page.
+        :kwarg token, continuation token returned with the previous page.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['From', 'Email'], keyword)
+        return self._page(list_name, query_string, limit, token, fields)
+
+    def page_search_subject(self, list_name, keyword, limit=30, token=None,
+                            fields=None):
+        """ Returns a page of the emails containing the specified keyword
+        in their subject.
+        Returns a tuple (emails, token), see KittyStore.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the subject of the emails.
+        :kwarg limit, number of emails per page.
+        :kwarg token, continuation token returned with the previous page.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them (see kittystore.SUMMARY_FIELDS).
+        """
+        query_string = search_query(['Subject'], keyword)
+        return self._page(list_name, query_string, limit, token, fields)
+
+    def count_search_content(self, list_name, keyword):
+        """ Returns the number of emails containing the specified keyword
+        in their content.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content of the emails.
+        """
+        mongodb = self.connection[list_name]
+        return count(mongodb.mails, search_query(['Content'], keyword))
+
+    def count_search_content_subject(self, list_name, keyword):
+        """ Returns the number of emails containing the specified keyword
+        in their content or their subject.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the content or subject of
+        the emails.
+        """
+        mongodb = self.connection[list_name]
+        query_string = search_query(['Content', 'Subject'], keyword)
+        return count(mongodb.mails, query_string)
+
+    def count_search_sender(self, list_name, keyword):
+        """ Returns the number of emails containing the specified keyword
+        in the name or email address of their sender.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the database.
+        """
+        mongodb = self.connection[list_name]
+        return count(mongodb.mails, search_query(['From', 'Email'], keyword))
+
+    def count_search_subject(self, list_name, keyword):
+        """ Returns the number of emails containing the specified keyword
+        in their subject.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the subject of the emails.
+        """
+        mongodb = self.connection[list_name]
+        return count(mongodb.mails, search_query(['Subject'], keyword))
+
+    def _page(self, list_name, query_string, limit, token, fields=None):
+        """ Return a page of the emails matching the given query sorted
+        by Date and _id, most recent first, starting after the email
+        pointed by the token. Returns a tuple (emails, token of the next
+        page).
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg query_string, the query document.
+        :arg limit, number of emails per page.
+        :arg token, continuation token returned with the previous page.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them.
+        """
+        mongodb = self.connection[list_name]
+        cursor = mongodb.mails.find(page_query(query_string, token),
+            projection(fields, ['Date']),
+            sort=[('Date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)])
+        mails = list(cursor.limit(limit))
+        next_token = None
+        if mails and len(mails) == limit:
+            next_token = encode_token(mails[-1]['Date'], mails[-1]['_id'])
+        return (mails, next_token)
+
+    def _search_text(self, list_name, keyword, field, limit, offset,
+                     fields):
+        """ Return the emails matching the keyword in the text index,
+        sorted by textScore.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg keyword, keyword to search in the database.
+        :arg field, the document key to which the matches are restricted,
+        None for both the subject and the content.
+        :arg limit, maximum number of emails returned, None for all.
+        :arg offset, number of emails skipped when a limit is given.
+        :arg fields, list of the fields to load, None for all of them.
+        """
+        if self.provisioned.get(list_name) is not None:
+            raise NotImplementedError('No text index on %s: %s' % (
+                list_name, self.provisioned[list_name]))
+        query_string = {'$text': {'$search': keyword}}
+        if field is not None:
+            # the text index covers both the subject and the content, the
+            # filter on the field only applies to the documents it matched
+            query_string.update(search_query([field], keyword))
+        score = {'score': {'$meta': 'textScore'}}
+        fields_projection = projection(fields) or {}
+        fields_projection.update(score)
+        mongodb = self.connection[list_name]
+        cursor = mongodb.mails.find(query_string, fields_projection,
+            sort=[('score', {'$meta': 'textScore'})])
+        if limit is not None:
+            cursor = cursor.skip(offset or 0).limit(limit)
+        return list(cursor)
+
+    def _search_limit(self, list_name, query_string, limit, offset,
+                      fields):
+        """ Return the list of the emails matching the given query, most
+        recent first, optionally paginated using limit and offset.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg query_string, the query document.
+        :arg limit, maximum number of emails returned, None for all.
+        :arg offset, number of emails skipped when a limit is given.
+        :arg fields, list of the fields to load, None for all of them.
+        """
+        mongodb = self.connection[list_name]
+        cursor = mongodb.mails.find(query_string, projection(fields),
+            sort=[('Date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)])
+        if limit is not None:
+            cursor = cursor.skip(offset or 0).limit(limit)
+        return list(cursor)
+
+    def _search(self, list_name, query_string, fields=None):
+        """ Return the cursor over the emails of a list matching the
+        given query, most recent first.
+
+        :arg list_name, name of the mailing list in which this email
+        should be searched.
+        :arg query_string, the query document.
+        :kwarg fields, list of the fields to load, defaults to all of
+        them.
         """
         mongodb = self.connection[list_name]
-        mongodb.mails.create_index('Date')
-        mongodb.mails.ensure_index('Date')
-        mongodb.mails.create_index('Subject')
-        mongodb.mails.ensure_index('Subject')
-        regex = '.*%s.*' % keyword
-        query_string = {'Subject': re.compile(regex)}
-        return list(mongodb.mails.find(query_string, sort=[('Date',
-            pymongo.DESCENDING)]))
+        return mongodb.mails.find(query_string, projection(fields),
+            sort=[('Date', pymongo.DESCENDING)])
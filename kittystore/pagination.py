@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+"""
+Continuation tokens used by the keyset pagination of the stores.
+
+A token identifies the last email of a page by its date and its unique
+identifier, the next page is then made of the emails sorted after it.
+The tokens are opaque for the callers: they should only be given back
+to the store that produced them.
+
+Copyright (C) 2012 Pierre-Yves Chibon
+Author: Pierre-Yves Chibon <pingou@pingoured.fr>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or (at
+your option) any later version.
+See http://www.gnu.org/copyleft/gpl.html  for the full text of the
+license.
+"""
+
+import base64
+import binascii
+from datetime import datetime
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_token(date, identifier):
+    """ Return the continuation token pointing after the given email.
+
+    :arg date, the datetime of the last email of the page.
+    :arg identifier, the unique identifier of the last email of the page.
+    """
+    value = '%s %s' % (date.strftime(DATE_FORMAT), identifier)
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+
+def decode_token(token):
+    """ Return the date and the identifier (as a string) stored in a
+    continuation token.
+    Raises a ValueError if the token is not valid.
+
+    :arg token, a continuation token as returned by encode_token.
+    """
+    try:
+        value = base64.urlsafe_b64decode(str(token)).decode('utf-8')
+        (date, identifier) = value.split(' ', 1)
+        return (datetime.strptime(date, DATE_FORMAT), identifier)
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError('Invalid continuation token: %r' % (token,))
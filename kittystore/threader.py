@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+KittyThreader - incremental assignment of the thread_id of the emails.
+
+The threader keeps an index of the Message-IDs seen so far grouped in
+threads (a disjoint-set forest). Each new email is placed in its thread
+with a lookup per Message-ID it mentions, the parents not seen yet are
+kept as placeholders. When a late email links two threads together,
+they are merged and the merge is reported so that the store can update
+the emails already written.
+
+Copyright (C) 2012 Pierre-Yves Chibon
+Author: Pierre-Yves Chibon <pingou@pingoured.fr>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or (at
+your option) any later version.
+See http://www.gnu.org/copyleft/gpl.html  for the full text of the
+license.
+"""
+
+from kittystore.importer import get_stable_url_id
+
+
+class Threader(object):
+    """ In-memory index of message_id -> thread_id, updated incrementally.
+
+    The thread of an email is identified by the stable url id of the
+    oldest email it references (the first of its References), or of
+    itself when it references none, as done by importer.parse_message.
+    """
+
+    def __init__(self):
+        """ Constructor, the index starts empty (see load). """
+        # message_id -> parent message_id, the roots point to themselves
+        self.parents = {}
+        # root message_id -> thread_id
+        self.threads = {}
+        # merged thread_id -> one of its message_id, see pop_merges
+        self.merged = {}
+
+    def __len__(self):
+        return len(self.parents)
+
+    def __contains__(self, message_id):
+        return message_id in self.parents
+
+    def find(self, message_id):
+        """ Return the root of the thread of a message, halving the path
+        to it on the way.
+
+        :arg message_id, a Message-ID already in the index.
+        """
+        parents = self.parents
+        while parents[message_id] != message_id:
+            parents[message_id] = parents[parents[message_id]]
+            message_id = parents[message_id]
+        return message_id
+
+    def get_thread_id(self, message_id):
+        """ Return the thread_id of a message, or None if the index does
+        not know it.
+
+        :arg message_id, the Message-ID of the email (without the <>).
+        """
+        if message_id not in self.parents:
+            return None
+        return self.threads[self.find(message_id)]
+
+    def add(self, message_id, thread_id=None):
+        """ Add a message in the index, if it is not already in it, and
+        return the root of its thread.
+
+        :arg message_id, the Message-ID of the email (without the <>).
+        :kwarg thread_id, the thread_id of the email, defaults to the
+        stable url id of its Message-ID (a new thread).
+        """
+        if message_id in self.parents:
+            return self.find(message_id)
+        self.parents[message_id] = message_id
+        if thread_id is None:
+            thread_id = get_stable_url_id(message_id)
+        self.threads[message_id] = thread_id
+        return message_id
+
+    def union(self, root, other):
+        """ Merge the thread of `other` into the thread of `root`, both
+        being roots. The thread_id of `root` is kept.
+
+        :arg root, the root of the thread absorbing the other.
+        :arg other, the root of the thread merged.
+        """
+        if root == other:
+            return
+        thread_id = self.threads.pop(other)
+        self.parents[other] = root
+        if thread_id != self.threads[root]:
+            self.merged[thread_id] = root
+
+    def load(self, index):
+        """ Fill the index with the emails already stored, given as
+        (message_id, thread_id) tuples (see KittyStore.get_thread_index).
+
+        :arg index, an iterable of (message_id, thread_id) tuples.
+        """
+        roots = {}
+        for (message_id, thread_id) in index:
+            if thread_id in roots:
+                self.parents[message_id] = roots[thread_id]
+            else:
+                roots[thread_id] = self.add(message_id, thread_id)
+
+    def assign(self, email):
+        """ Set the thread_id of an email and add it to the index. Returns
+        the thread_id.
+
+        :arg email, a dictionnary holding the fields of the email, keyed
+        by the column names of kittysamodel.get_table, plus in_reply_to
+        (see importer.parse_message).
+        """
+        message_ids = (email.get('references') or '').split()
+        in_reply_to = email.get('in_reply_to')
+        if in_reply_to and in_reply_to not in message_ids:
+            message_ids.append(in_reply_to)
+        message_ids.append(email['message_id'])
+        # the thread of the oldest reference absorbs the others
+        root = self.add(message_ids[0])
+        for message_id in message_ids[1:]:
+            if message_id in self.parents:
+                self.union(root, self.find(message_id))
+            else:
+                self.parents[message_id] = root
+        email['thread_id'] = self.threads[root]
+        return email['thread_id']
+
+    def pop_merges(self):
+        """ Return the merges done since the last call as a dictionnary
+        {thread_id: [merged thread_id, ...]} and forget them.
+        """
+        merges = {}
+        for (thread_id, message_id) in self.merged.items():
+            target = self.threads[self.find(message_id)]
+            if target != thread_id:
+                merges.setdefault(target, []).append(thread_id)
+        self.merged = {}
+        return merges
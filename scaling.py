@@ -0,0 +1,225 @@
+import argparse
+import json
+import math
+import os
+import tests
+from compare_results import median
+from kittystore.generator import ListGenerator
+from kittystore.importer import import_emails
+
+# Variants whose time depends on the size of the list, the cached ones
+# and the PG-TRGM ones (another database) are left out
+VARIANTS = ['PG', 'PG-IN', 'PG-OR', 'PG-OR-CS', 'PG-CS', 'PG-RANK', 'MG',
+            'MG-IN', 'MG-CS']
+
+# Growth models fitted, time = a + b * f(size)
+MODELS = [
+    ('O(1)', None),
+    ('O(log n)', math.log),
+    ('O(n)', lambda size: float(size)),
+    ('O(n log n)', lambda size: size * math.log(size)),
+]
+
+
+def fit(sizes, times):
+    """ Return a list of (model, a, b, bic) of the models fitted on the
+    timings of a method, the best one (lowest BIC) first.
+
+    :arg sizes, the sizes of the lists.
+    :arg times, the median time of the method for each size.
+    """
+    count = len(sizes)
+    mean = sum(times) / count
+    fits = []
+    for (name, function) in MODELS:
+        if function is None:
+            (a_value, b_value, params) = (mean, 0.0, 1)
+        else:
+            values = [function(size) for size in sizes]
+            x_mean = sum(values) / count
+            variance = sum((value - x_mean) ** 2 for value in values)
+            if not variance:
+                continue
+            b_value = sum((value - x_mean) * (time - mean) for
+                          (value, time) in zip(values, times)) / variance
+            if b_value <= 0:
+                # not growing, the constant model covers it
+                continue
+            a_value = mean - b_value * x_mean
+            params = 2
+        residuals = sum(
+            (time - a_value - b_value * (function(size) if function else 0))
+            ** 2 for (size, time) in zip(sizes, times))
+        bic = count * math.log(max(residuals / count, 1e-30)) \
+            + params * math.log(count)
+        fits.append((name, a_value, b_value, bic))
+    return sorted(fits, key=lambda entry: entry[3])
+
+
+def exponent(sizes, times):
+    """ Return the slope of log(time) against log(size), 0 for a constant
+    time and 1 for a linear one.
+    """
+    points = [(math.log(size), math.log(time))
+              for (size, time) in zip(sizes, times) if time > 0]
+    if len(points) < 2:
+        return float('nan')
+    x_mean = sum(point[0] for point in points) / len(points)
+    y_mean = sum(point[1] for point in points) / len(points)
+    variance = sum((point[0] - x_mean) ** 2 for point in points)
+    return sum((point[0] - x_mean) * (point[1] - y_mean)
+               for point in points) / variance
+
+
+def generate(list_name, size, seed, fixtures):
+    """ Generate a list in both backends, index it, build its thread
+    summaries and write its fixtures. The PG table is created by
+    import_emails (see KittySAStore.create_list). The get_thread_*
+    methods then read the summaries, as they do in production.
+    """
+    stores = [(tests.db_store_factory(), {'copy': True}),
+              (tests.mg_store_factory(), {})]
+    for (store, kwargs) in stores:
+        generator = ListGenerator(size, seed=seed)
+        (total, elapsed) = import_emails(store, list_name, generator,
+                                         **kwargs)
+        print '%s emails generated in %.2f s' % (total, elapsed)
+    (db_store, mg_store) = (stores[0][0], stores[1][0])
+    db_store.add_fulltext_indexes(list_name)
+    db_store.add_search_vector(list_name)
+    db_store.add_thread_summary(list_name)
+    mg_store.provision_indexes(list_name)
+    mg_store.add_thread_summary(list_name)
+    stream = open(fixtures, 'w')
+    json.dump(generator.fixtures(list_name), stream, indent=2,
+              sort_keys=True)
+    stream.close()
+
+
+def run_size(size, fixtures, names, directory):
+    """ Run the tests against the list of a size, in its own directory.
+    Returns the results {test: {variant: [seconds, ...]}}.
+    """
+    vars(tests).update(tests.read_fixtures(fixtures))
+    tests.results.clear()
+    tests.metrics.clear()
+    tests.plans.clear()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    current = os.getcwd()
+    os.chdir(directory)
+    try:
+        metadata = tests.environment()
+        tests.mg_store_factory().provision_indexes(tests.TABLE)
+        for name in names:
+            getattr(tests, name)(tests.REP)
+        metadata['tests'] = names
+        tests.write_results(tests.RESULTS, metadata)
+    finally:
+        os.chdir(current)
+    return json.loads(json.dumps(tests.results))
+
+
+def report(samples, sizes):
+    """ Return the rows of the scaling report: test, variant, model,
+    exponent, projected time at twice the largest size, then the median
+    time for each size.
+    """
+    rows = []
+    for testname in sorted(samples[sizes[0]]):
+        for variant in sorted(samples[sizes[0]][testname]):
+            medians = [median(samples[size][testname][variant])
+                       for size in sizes
+                       if samples[size].get(testname, {}).get(variant)]
+            if len(medians) != len(sizes):
+                continue
+            fits = fit(sizes, medians)
+            (model, a_value, b_value, _) = fits[0]
+            function = dict(MODELS)[model]
+            projected = a_value + b_value * (
+                function(sizes[-1] * 2) if function else 0)
+            rows.append([testname, variant, model,
+                         '%.2f' % exponent(sizes, medians),
+                         '%.6f' % projected]
+                        + ['%.6f' % value for value in medians])
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the tests against generated lists of increasing '
+        'sizes and fit the growth of the time of each method')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='sizes of the lists (default: 10000 100000 '
+                        '1000000)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the generated lists')
+    parser.add_argument('--prefix', default='scale',
+                        help='prefix of the names of the generated lists')
+    parser.add_argument('--generate', action='store_true',
+                        help='generate the lists whose fixtures are '
+                        'missing')
+    parser.add_argument('--tests', nargs='+', metavar='TEST',
+                        help='tests to run, defaults to all of them but '
+                        'connection_pooling')
+    parser.add_argument('--variants', nargs='+', metavar='VARIANT',
+                        default=VARIANTS,
+                        help='variants to run (default: %s)'
+                        % ' '.join(VARIANTS))
+    parser.add_argument('--rep', type=int, default=10,
+                        help='number of timed calls per variant')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='number of untimed calls made first')
+    parser.add_argument('--url', help='PostgreSQL URL')
+    parser.add_argument('--mongo-host', help='MongoDB host')
+    parser.add_argument('--mongo-port', type=int, help='MongoDB port')
+    args = parser.parse_args(argv)
+
+    (tests.REP, tests.WARMUP, tests.VARIANTS) = (args.rep, args.warmup,
+                                                 args.variants)
+    tests.POOLED = True
+    if args.url:
+        tests.URL = args.url
+    if args.mongo_host:
+        tests.MG_HOST = args.mongo_host
+    if args.mongo_port:
+        tests.MG_PORT = args.mongo_port
+    names = args.tests or [test.__name__ for test in tests.TESTS
+                           if test is not tests.connection_pooling]
+    unknown = [name for name in names if name not in
+               [test.__name__ for test in tests.TESTS]]
+    if unknown:
+        parser.error('unknown tests: %s' % ', '.join(unknown))
+    sizes = sorted(set(args.sizes))
+    if len(sizes) < 2:
+        parser.error('at least two sizes are needed to fit the growth')
+
+    samples = {}
+    for size in sizes:
+        list_name = '%s_%s' % (args.prefix, size)
+        fixtures = os.path.abspath('%s_fixtures.json' % list_name)
+        if not os.path.exists(fixtures):
+            if not args.generate:
+                parser.error('%s is missing, use --generate' % fixtures)
+            generate(list_name, size, args.seed, fixtures)
+        print 'Size %s' % size
+        samples[size] = run_size(size, fixtures, names, list_name)
+
+    stream = open('scaling.json', 'w')
+    json.dump({'sizes': sizes, 'results': samples}, stream, indent=2,
+              sort_keys=True)
+    stream.close()
+    header = ['test', 'variant', 'model', 'exponent',
+              'projected_%s' % (sizes[-1] * 2)] \
+        + ['size_%s' % size for size in sizes]
+    stream = open('scaling', 'w')
+    stream.write(tests.row(header))
+    for entry in report(samples, sizes):
+        print '%-40s %-9s %-11s %6s %12s' % tuple(entry[:5])
+        stream.write(tests.row(entry))
+    stream.close()
+
+
+if __name__ == '__main__':
+    main()